@@ -1,2 +1,8 @@
 from .system_parser import *
-from .model import *
\ No newline at end of file
+from .model import *
+from .results import *
+from .cache import *
+from .metrics import *
+from .fit import *
+from .plotting import *
+from .sweep import *
\ No newline at end of file
@@ -0,0 +1,128 @@
+import numpy as np
+import scipy.linalg
+
+
+def propagate(rate_matrix, input_vector, y0, times, chunk_size=4096):
+    """
+    Evaluates the closed-form solution of the linear time-invariant system dy/dt = A y + u,
+    y(0) = y0, at all requested times at once.
+
+    The constant input u is absorbed into an augmented matrix M = [[A, u], [0, 0]], so that
+    [y(t), 1] = exp(M t) [y0, 1]. The exponential is evaluated for all times together from the
+    eigendecomposition of M; if M is not (numerically) diagonalisable, scipy.linalg.expm is used instead.
+    All inputs may carry matching leading (batch) dimensions.
+
+    :param rate_matrix: The rate matrix A, of shape (..., n, n).
+    :type rate_matrix: array_like
+    :param input_vector: The constant input u (i.e. the dose vector times the dose rate), of shape (..., n).
+    :type input_vector: array_like
+    :param y0: The initial state, of shape (..., n).
+    :type y0: array_like
+    :param times: The (non-negative) times at which to evaluate the solution, of shape (T,).
+    :type times: array_like
+    :param chunk_size: The number of times per batched call to scipy.linalg.expm (fallback only). Default is 4096.
+    :type chunk_size: int
+    :return: The solution, of shape (..., n, T).
+    :rtype: numpy.ndarray
+    """
+    A = np.asarray(rate_matrix, dtype=float)
+    times = np.asarray(times, dtype=float)
+    batch, n = A.shape[:-2], A.shape[-1]
+
+    M = np.zeros(batch + (n + 1, n + 1))
+    M[..., :n, :n] = A
+    M[..., :n, n] = np.broadcast_to(input_vector, batch + (n,))
+    z0 = np.ones(batch + (n + 1,))
+    z0[..., :n] = np.broadcast_to(y0, batch + (n,))
+
+    eigenvalues, V = np.linalg.eig(M)
+    if np.all(np.linalg.cond(V) < 1e8):
+        c = np.linalg.solve(V, z0[..., None])[..., 0]
+        z = np.einsum('...ij,...j,...jt->...it', V, c, np.exp(eigenvalues[..., :, None] * times))
+        return z[..., :n, :].real
+
+    # defective (e.g. no elimination under continuous dosing): batched matrix exponentials
+    y = np.empty(batch + (n, times.size))
+    for start in range(0, times.size, chunk_size):
+        t = times[start:start + chunk_size]
+        expMt = scipy.linalg.expm(M[..., None, :, :] * t[:, None, None])
+        y[..., start:start + t.size] = np.einsum('...tij,...j->...it', expMt, z0)[..., :n, :]
+    return y
+
+
+def propagate_sensitivities(rate_matrix, input_vector, y0, s0, rate_matrix_derivatives, times, chunk_size=None):
+    """
+    Evaluates the closed-form solution of the linear time-invariant system dy/dt = A y + u, y(0) = y0 (see
+    :func:`propagate`), together with its derivatives with respect to parameters p of the rate matrix A = A(p).
+
+    With the augmented matrix M = [[A, u], [0, 0]] and its eigendecomposition M = V diag(l) V^-1, the derivative of
+    exp(M t) in the direction dM is V (F(t) * (V^-1 dM V)) V^-1, where F_ij(t) = (exp(l_i t) - exp(l_j t)) / (l_i - l_j)
+    (or t exp(l_i t) if l_i = l_j). If M is not (numerically) diagonalisable, the derivative is read off the
+    matrix exponential of the block matrix [[M, dM], [0, M]] instead.
+
+    :param rate_matrix: The rate matrix A, of shape (n, n).
+    :type rate_matrix: array_like
+    :param input_vector: The constant input u, of shape (n,).
+    :type input_vector: array_like
+    :param y0: The initial state, of shape (n,).
+    :type y0: array_like
+    :param s0: The derivatives of the initial state with respect to the parameters, of shape (P, n).
+    :type s0: array_like
+    :param rate_matrix_derivatives: The derivatives dA/dp of the rate matrix, of shape (P, n, n).
+    :type rate_matrix_derivatives: array_like
+    :param times: The (non-negative) times at which to evaluate the solution, of shape (T,).
+    :type times: array_like
+    :param chunk_size: The number of times evaluated at once. Defaults to a number that bounds the memory use.
+    :type chunk_size: int
+    :return: The solution, of shape (n, T), and its derivatives, of shape (P, n, T).
+    :rtype: tuple
+    """
+    A = np.asarray(rate_matrix, dtype=float)
+    dA = np.asarray(rate_matrix_derivatives, dtype=float)
+    times = np.asarray(times, dtype=float)
+    n, P = A.shape[-1], dA.shape[0]
+    m = n + 1
+    chunk_size = chunk_size or max(2**22 // (m * m * max(P, 1)), 1)
+
+    M = np.zeros((m, m))
+    M[:n, :n], M[:n, n] = A, input_vector
+    dM = np.zeros((P, m, m))
+    dM[:, :n, :n] = dA
+    z0 = np.append(np.asarray(y0, dtype=float), 1.0)
+    dz0 = np.zeros((P, m))
+    dz0[:, :n] = s0
+
+    y, s = np.empty((n, times.size)), np.empty((P, n, times.size))
+    eigenvalues, V = np.linalg.eig(M)
+    if np.linalg.cond(V) < 1e8:
+        V_inv = np.linalg.inv(V)
+        c, dc = V_inv @ z0, dz0 @ V_inv.T
+        G = V_inv @ dM @ V
+        # divided differences of exp(l t), computed stably (without overflow) as exp(l_k t) expm1(d t) / d
+        # from the eigenvalue l_k with the larger real part, with d = l_i - l_j or l_j - l_i such that Re(d) <= 0
+        difference = eigenvalues[:, None] - eigenvalues[None, :]
+        from_i = difference.real >= 0
+        d = np.where(from_i, -difference, difference)[..., None]
+        d_safe = np.where(d == 0, 1, d)
+        for start in range(0, times.size, chunk_size):
+            t = times[start:start + chunk_size]
+            E = np.exp(eigenvalues[:, None] * t)
+            base = np.where(from_i[..., None], E[:, None, :], E[None, :, :])
+            F = np.where(d == 0, t * base, base * np.expm1(d * t) / d_safe)
+            y[:, start:start + t.size] = (V @ (c[:, None] * E))[:n].real
+            # contracted in stages (over j, then i) rather than as one four-operand product, which is O(P n^4 T)
+            dz = V @ (np.einsum('pij,ijt->pit', G, F * c[None, :, None], optimize=True) + dc[:, :, None] * E)
+            s[:, :, start:start + t.size] = dz[:, :n].real
+        return y, s
+
+    # defective: batched matrix exponentials of [[M, dM], [0, M]]
+    block = np.zeros((P, 2 * m, 2 * m))
+    block[:, :m, :m] = block[:, m:, m:] = M
+    block[:, :m, m:] = dM
+    for start in range(0, times.size, chunk_size):
+        t = times[start:start + chunk_size]
+        expMt = scipy.linalg.expm(block[:, None] * t[:, None, None])    # shape (P, T, 2m, 2m)
+        y[:, start:start + t.size] = np.einsum('tij,j->it', scipy.linalg.expm(M * t[:, None, None]), z0)[:n]
+        s[:, :, start:start + t.size] = (np.einsum('ptij,j->pit', expMt[..., :m, m:], z0)
+                                         + np.einsum('ptij,pj->pit', expMt[..., :m, :m], dz0))[:, :n]
+    return y, s
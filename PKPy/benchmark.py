@@ -0,0 +1,186 @@
+"""
+Benchmarks of parsing, model construction, solving and plotting across model sizes.
+
+Run from the command line, e.g.
+
+    python -m PKPy.benchmark --peripheral 1 10 100 --time-span 100 10000 --output benchmark.json
+    python -m PKPy.benchmark --baseline benchmark.json     # fails if any timing regressed against the baseline
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import scipy
+
+from .system_parser import Parser
+from .model import Model
+
+
+def synthetic_config(n_peripheral, subcutaneous, time_span, dose=(10, 'continuous')):
+    """
+    Builds a synthetic system configuration (in the layout of the JSON config file) with a central compartment,
+    any number of peripheral compartments of varying volumes and rates, and optionally a subcutaneous compartment.
+
+    :param n_peripheral: The number of peripheral compartments.
+    :type n_peripheral: int
+    :param subcutaneous: Whether to add a subcutaneous compartment.
+    :type subcutaneous: bool
+    :param time_span: The time span of the model.
+    :type time_span: int
+    :param dose: The dose parameter of the model. Default is (10, 'continuous').
+    :type dose: tuple
+    :return: The system configuration.
+    :rtype: dict
+    """
+    config = {'basic_parameters': {'time_span': time_span, 'subcutaneous': int(subcutaneous), 'dose': list(dose)},
+              'compartment_0': {'name': 'central', 'type': 'central', 'volume': 5000, 'initial_amount': 0.0,
+                                'rate_out': 10.0}}
+    for i in range(1, n_peripheral + 1):
+        config[f'compartment_{i}'] = {'name': f'peripheral_{i}', 'type': 'peripheral', 'volume': 100.0 * (1 + i % 20),
+                                      'initial_amount': 0.0, 'rate_in': 0.1 * (1 + i % 7), 'rate_out': 0.0}
+    if subcutaneous:
+        config['compartment_sc'] = {'name': 'subcutaneous', 'type': 'subcutaneous', 'volume': 100.0,
+                                    'initial_amount': 0.0, 'rate_out': 0.5}
+    return config
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_case(n_peripheral, subcutaneous, time_span, method='RK45', plot=True, directory=None):
+    """
+    Benchmarks one synthetic model: the time of Parser.construct, Model.__init__, Model.solve and Model.plot,
+    the number of right-hand side evaluations and the peak memory (as traced by tracemalloc) of the solve. The solve is
+    timed without tracing, and its peak memory measured in a second, traced solve.
+
+    :param n_peripheral: The number of peripheral compartments.
+    :type n_peripheral: int
+    :param subcutaneous: Whether the model has a subcutaneous compartment.
+    :type subcutaneous: bool
+    :param time_span: The time span of the model.
+    :type time_span: int
+    :param method: The solve method. Default is 'RK45'.
+    :type method: str
+    :param plot: Whether to benchmark Model.plot. Default is True.
+    :type plot: bool
+    :param directory: The directory for the config file and plot. Defaults to a temporary directory.
+    :type directory: str
+    :return: The case parameters and measurements.
+    :rtype: dict
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, 'system.json')
+        with open(path, 'w') as f:
+            json.dump(synthetic_config(n_peripheral, subcutaneous, time_span), f)
+
+        parser = Parser(path)
+        _, parse_s = _timed(parser.construct)
+        model, init_s = _timed(Model, path)
+
+        _, solve_s = _timed(model.solve, method=method, save=False)
+        rhs_evals = model.solve_stats['nfev']
+        # the peak memory in a separate solve, since tracing every allocation slows the solve down several-fold
+        tracemalloc.start()
+        model.solve(method=method, save=False)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        plot_s = _timed(model.plot, output=os.path.join(tmp, 'plot.png'), dpi=100)[1] if plot else None
+
+    return {'n_peripheral': n_peripheral, 'subcutaneous': subcutaneous, 'time_span': time_span, 'method': method,
+            'parse_s': parse_s, 'init_s': init_s, 'solve_s': solve_s, 'plot_s': plot_s,
+            'rhs_evals': rhs_evals, 'peak_memory_bytes': peak_memory}
+
+
+def run(peripheral=(1, 10, 100, 500), subcutaneous=(False, True), time_spans=(100, 1000, 10000),
+        method='RK45', plot=True):
+    """
+    Benchmarks all combinations of the given model sizes, dosing routes and time spans.
+
+    :param peripheral: The numbers of peripheral compartments. Default is (1, 10, 100, 500).
+    :type peripheral: tuple
+    :param subcutaneous: Whether the models have a subcutaneous compartment. Default is (False, True).
+    :type subcutaneous: tuple
+    :param time_spans: The time spans. Default is (100, 1000, 10000).
+    :type time_spans: tuple
+    :param method: The solve method. Default is 'RK45'.
+    :type method: str
+    :param plot: Whether to benchmark Model.plot. Default is True.
+    :type plot: bool
+    :return: The benchmark results, with metadata on the environment.
+    :rtype: dict
+    """
+    results = [run_case(n, sc, span, method, plot) for n in peripheral for sc in subcutaneous for span in time_spans]
+    metadata = {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+                'platform': platform.platform()}
+    return {'metadata': metadata, 'results': results}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares benchmark results against a baseline, case by case.
+
+    :param results: The benchmark results, as returned by :func:`run`.
+    :type results: dict
+    :param baseline: The baseline results, in the same format.
+    :type baseline: dict
+    :param tolerance: The allowed relative increase of every measurement. Default is 0.2.
+    :type tolerance: float
+    :return: The regressions, as (case, measurement, baseline value, new value) tuples.
+    :rtype: list
+    """
+    case_keys = ('n_peripheral', 'subcutaneous', 'time_span', 'method')
+    reference = {tuple(case[key] for key in case_keys): case for case in baseline['results']}
+    regressions = []
+    for case in results['results']:
+        base = reference.get(tuple(case[key] for key in case_keys))
+        if base is None:
+            continue
+        for measurement in ('parse_s', 'init_s', 'solve_s', 'plot_s', 'rhs_evals', 'peak_memory_bytes'):
+            if case[measurement] is not None and base[measurement] is not None \
+                    and case[measurement] > base[measurement] * (1 + tolerance):
+                regressions.append((dict((key, case[key]) for key in case_keys), measurement,
+                                    base[measurement], case[measurement]))
+    return regressions
+
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    arguments.add_argument('--peripheral', type=int, nargs='+', default=[1, 10, 100, 500])
+    arguments.add_argument('--time-span', type=int, nargs='+', default=[100, 1000, 10000])
+    arguments.add_argument('--method', default='RK45')
+    arguments.add_argument('--no-subcutaneous', action='store_true', help='only benchmark models without one')
+    arguments.add_argument('--no-plot', action='store_true', help='do not benchmark Model.plot')
+    arguments.add_argument('--output', help='write the results to this JSON file')
+    arguments.add_argument('--baseline', help='compare the results against this JSON file')
+    arguments.add_argument('--tolerance', type=float, default=0.2)
+    args = arguments.parse_args(argv)
+
+    results = run(args.peripheral, (False,) if args.no_subcutaneous else (False, True), args.time_span,
+                  args.method, not args.no_plot)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for case, measurement, before, after in regressions:
+            print(f'REGRESSION {case} {measurement}: {before:.4g} -> {after:.4g}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
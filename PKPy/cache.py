@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import collections
+import numpy as np
+
+from .results import ResultsReader, ResultsWriter
+
+
+class SolutionCache:
+    """
+    This class caches model solutions, keyed on the model configuration and the solver options, so that repeated
+    solves of an unchanged model cost a lookup instead of an ODE solve. Solutions are kept in memory and, optionally,
+    on disk (as results files, see :class:`ResultsReader`); both are bounded in size and evict the least recently
+    used solutions first.
+
+    :param directory: The directory of the disk cache. Default is None (memory only).
+    :type directory: str
+    :param max_memory_bytes: The maximum size of the solutions kept in memory. Default is 256 MiB.
+    :type max_memory_bytes: int
+    :param max_disk_bytes: The maximum size of the solutions kept on disk. Default is 1 GiB.
+    :type max_disk_bytes: int
+
+    :ivar int hits: The number of lookups that found a cached solution.
+    :ivar int misses: The number of lookups that did not.
+
+    :Usage Example:
+
+    >>> cache = SolutionCache('cache/')
+    >>> model = Model('system.json')
+    >>> model.solve(cache=cache)    # solves, and caches the solution
+    >>> model.solve(cache=cache)    # returns the cached solution
+    """
+    def __init__(self, directory=None, max_memory_bytes=256 * 2**20, max_disk_bytes=2**30):
+        """
+        Initializes a SolutionCache object.
+
+        :param directory: The directory of the disk cache. Default is None (memory only).
+        :type directory: str
+        :param max_memory_bytes: The maximum size of the solutions kept in memory. Default is 256 MiB.
+        :type max_memory_bytes: int
+        :param max_disk_bytes: The maximum size of the solutions kept on disk. Default is 1 GiB.
+        :type max_disk_bytes: int
+        """
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+
+    @staticmethod
+    def key(config_hash, **options):
+        """
+        Returns the cache key of a solution.
+
+        :param config_hash: The hash of the (normalised) model configuration, see :attr:`Model.config_hash`.
+        :type config_hash: str
+        :param options: The solver options (e.g. method and tolerances).
+        :return: The cache key.
+        :rtype: str
+        """
+        return hashlib.sha256(json.dumps([config_hash, options], sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkpy')
+
+    def get(self, key):
+        """
+        Looks up a solution in memory, then on disk.
+
+        :param key: The cache key, see :meth:`key`.
+        :type key: str
+        :return: A dictionary containing the (read-only) timeseries for each compartment, or None if not cached.
+        :rtype: dict
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return dict(self._memory[key])
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                timeseries = {name: np.array(series) for name, series in ResultsReader(self._path(key)).to_dict().items()}
+                os.utime(self._path(key))       # mark as recently used
+            except (FileNotFoundError, ValueError):
+                pass                            # evicted (or replaced) concurrently
+            else:
+                self.hits += 1
+                return dict(self._remember(key, timeseries))
+        self.misses += 1
+        return None
+
+    def put(self, key, timeseries):
+        """
+        Stores a solution in memory and, if the cache has a directory, on disk.
+
+        :param key: The cache key, see :meth:`key`.
+        :type key: str
+        :param timeseries: A dictionary containing the timeseries for each compartment.
+        :type timeseries: dict
+        """
+        timeseries = self._remember(key, {name: np.array(series) for name, series in timeseries.items()})
+        if self.directory is None:
+            return
+        n_times = len(next(iter(timeseries.values())))
+        with ResultsWriter(self._path(key), list(timeseries), n_times, model_hash=key) as writer:
+            if n_times:
+                writer.write(0, np.stack(list(timeseries.values())))
+        self._evict_disk()
+
+    def _remember(self, key, timeseries):
+        for series in timeseries.values():
+            series.setflags(write=False)
+        size = sum(series.nbytes for series in timeseries.values())
+        if key in self._memory:
+            self._memory_bytes -= sum(series.nbytes for series in self._memory.pop(key).values())
+        if size <= self.max_memory_bytes:
+            self._memory[key] = timeseries
+            self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= sum(series.nbytes for series in evicted.values())
+        return timeseries
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkpy'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Removes all solutions from the cache, in memory and on disk.
+        """
+        self._memory.clear()
+        self._memory_bytes = 0
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkpy'):
+                    os.remove(os.path.join(self.directory, name))
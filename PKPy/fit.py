@@ -0,0 +1,158 @@
+import time
+import concurrent.futures
+import numpy as np
+import scipy.optimize
+
+from .model import Model, SENSITIVITY_PARAMETERS, PARAMETER_ARRAYS
+
+_worker_model = None    # the model fitted by a worker process, built once per process
+
+
+def _init_worker(config, inputs):
+    global _worker_model
+    _worker_model = Model.from_config(*config)
+    _worker_model._set_solve_inputs(inputs)     # the current dosing, time span, edges and parameters of the model
+
+
+class _Objective:
+    """
+    The residuals (model concentrations minus observed concentrations) of a fit, and their Jacobian with respect to
+    the logarithms of the free parameters, from one solve per parameter vector (see :meth:`Model.sensitivities`).
+    The model is solved only at the observation times, and updated in place (see :meth:`Model.set_parameters`).
+    """
+    def __init__(self, model, observations, free_params, method):
+        self.model, self.free_params, self.method = model, free_params, method
+        names = model.names
+        self.times = np.unique(np.concatenate([np.asarray(times, dtype=float) for times, _ in observations.values()]))
+        self.observations = [(names.index(name), np.searchsorted(self.times, times), np.asarray(observed, dtype=float))
+                             for name, (times, observed) in observations.items()]
+        self.volume_index = {name: p for p, (name, parameter) in enumerate(free_params) if parameter == 'volume'}
+        self.n_solves = 0
+        self._x = None
+
+    def _evaluate(self, x):
+        if self._x is not None and np.array_equal(x, self._x):
+            return
+        values = np.exp(x)
+        self.model.set_parameters(dict(zip(self.free_params, values)))
+        timeseries, sensitivities = self.model.sensitivities(self.free_params, method=self.method, times=self.times)
+        self.n_solves += 1
+
+        residuals, jacobian = [], []
+        for i, index, observed in self.observations:
+            name, volume = self.model.names[i], self.model.volumes[i]
+            concentration = timeseries[name][index] / volume
+            derivatives = np.stack([sensitivities[pair][i][index] for pair in self.free_params], axis=1) / volume
+            if name in self.volume_index:     # the concentration also depends on the volume directly
+                derivatives[:, self.volume_index[name]] -= concentration / volume
+            residuals.append(concentration - observed)
+            jacobian.append(derivatives * values)   # with respect to log(parameter)
+        self._x, self._residuals, self._jacobian = x.copy(), np.concatenate(residuals), np.concatenate(jacobian)
+
+    def residuals(self, x):
+        self._evaluate(x)
+        return self._residuals
+
+    def jacobian(self, x):
+        self._evaluate(x)
+        return self._jacobian
+
+
+def _fit_start(model, observations, free_params, x0, bounds, method, options):
+    # one local least-squares fit from the log-parameters x0
+    start = time.perf_counter()
+    objective = _Objective(model, observations, free_params, method)
+    result = scipy.optimize.least_squares(objective.residuals, x0, jac=objective.jacobian, bounds=bounds, **options)
+    return {'parameters': dict(zip(free_params, np.exp(result.x).tolist())), 'cost': float(result.cost),
+            'success': bool(result.success), 'message': result.message, 'n_solves': objective.n_solves,
+            'time': time.perf_counter() - start}
+
+
+def _fit_worker(observations, free_params, x0, bounds, method, options):
+    return _fit_start(_worker_model, observations, free_params, x0, bounds, method, options)
+
+
+def fit(model, observations, free_params, n_starts=1, bounds=None, spread=1.0, seed=None, max_workers=None,
+        method='analytic', **options):
+    """
+    Estimates compartment parameters of a model from timed concentration samples, by nonlinear least squares
+    (scipy.optimize.least_squares) on the logarithms of the parameters, with the exact gradient from the forward
+    sensitivities of the model (see :meth:`Model.sensitivities`). The model is solved only at the observation times,
+    and its assembled system is updated in place between evaluations. Independent random restarts run in parallel
+    on a pool of worker processes. The model is left with the best parameters found.
+
+    :param model: The model, whose current parameters are the starting point of the first start.
+    :type model: Model
+    :param observations: A dictionary mapping compartment names to (times, concentrations) pairs of arrays, with
+        times within [0, time_span) and concentrations the amounts divided by the compartment volume.
+    :type observations: dict
+    :param free_params: The parameters to estimate, as (compartment name, parameter) pairs with parameter one of
+        'volume', 'rate_in' and 'rate_out'.
+    :type free_params: list
+    :param n_starts: The number of starts. Default is 1.
+    :type n_starts: int
+    :param bounds: A dictionary mapping free parameters to (lower, upper) bounds. Default is None (positive only).
+    :type bounds: dict
+    :param spread: The standard deviation of the log-normal perturbation of the starting point of the further
+        starts (parameters with both bounds are instead drawn log-uniformly within them). Default is 1.0.
+    :type spread: float
+    :param seed: The seed of the random starting points. Default is None.
+    :type seed: int
+    :param max_workers: The number of worker processes for more than one start. Defaults to the number of CPUs.
+    :type max_workers: int
+    :param method: The method of :meth:`Model.sensitivities`. Default is 'analytic'.
+    :type method: str
+    :param options: Keyword arguments passed on to scipy.optimize.least_squares (e.g. xtol, max_nfev).
+    :return: A dictionary with the best 'parameters' (a dictionary of the free parameters), its 'cost' (half the sum
+        of squared residuals), 'success' and 'message', the total number of solves 'n_solves', the wall 'time', and
+        the results of the individual 'starts' (dictionaries of the same keys, each with its own timing and solves).
+    :rtype: dict
+    :raises ValueError: If a free parameter is unknown or not positive, or an observed compartment does not exist.
+
+    :Usage Example:
+
+    >>> observations = {'Bloodstream': ([1, 2, 4, 8, 24], [0.8, 1.3, 1.6, 1.2, 0.4])}
+    >>> result = fit(model, observations, [('Bloodstream', 'volume'), ('Bloodstream', 'rate_out')], n_starts=8)
+    >>> result['parameters'], result['time'], result['n_solves']
+    """
+    free_params = [tuple(pair) for pair in free_params]
+    names = model.names
+    for name, parameter in free_params:
+        if parameter not in SENSITIVITY_PARAMETERS:
+            raise ValueError(f"Only the parameters {list(SENSITIVITY_PARAMETERS)} can be fitted, not '{parameter}'.")
+        if names.count(name) != 1:
+            raise ValueError(f"There must be exactly one compartment named '{name}'.")
+        if not getattr(model, PARAMETER_ARRAYS[parameter])[names.index(name)] > 0:
+            raise ValueError(f"The {parameter} of compartment {name} must start from a positive value.")
+    for name in observations:
+        if name not in names:
+            raise ValueError(f"There is no compartment named {name} in the model.")
+
+    bounds = bounds or {}
+    with np.errstate(divide='ignore'):
+        lower = np.log([bounds.get(pair, (0, np.inf))[0] for pair in free_params])
+        upper = np.log([bounds.get(pair, (0, np.inf))[1] for pair in free_params])
+    x0 = np.clip(np.log([getattr(model, PARAMETER_ARRAYS[parameter])[names.index(name)]
+                         for name, parameter in free_params]), lower, upper)
+    rng = np.random.default_rng(seed)
+    starts = [x0]
+    for _ in range(n_starts - 1):
+        bounded = np.isfinite(lower) & np.isfinite(upper)
+        starts.append(np.where(bounded, rng.uniform(np.where(bounded, lower, 0), np.where(bounded, upper, 0)),
+                               np.clip(x0 + rng.normal(0, spread, x0.size), lower, upper)))
+
+    clock = time.perf_counter()
+    log_bounds = (lower, upper)
+    if n_starts == 1:
+        results = [_fit_start(model, observations, free_params, starts[0], log_bounds, method, options)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                    initargs=(model.config, model._solve_inputs())) as executor:
+            futures = [executor.submit(_fit_worker, observations, free_params, x, log_bounds, method, options)
+                       for x in starts]
+            results = [future.result() for future in futures]
+
+    best = min(results, key=lambda result: result['cost'])
+    model.set_parameters(best['parameters'])
+    return {**best, 'n_solves': sum(result['n_solves'] for result in results), 'time': time.perf_counter() - clock,
+            'starts': results}
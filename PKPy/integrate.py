@@ -0,0 +1,160 @@
+import numpy as np
+import scipy.integrate
+
+METHODS = {name: getattr(scipy.integrate, name) for name in ['RK23', 'RK45', 'DOP853', 'Radau', 'BDF', 'LSODA']}
+STATS = ('nfev', 'njev', 'nlu', 'n_steps', 'n_rejected')    # solver statistics recorded by stream_ivp
+
+
+def stream_ivp(fun, t_span, y0, t_eval, method='RK45', chunk_size=None, stats=None, **options):
+    """
+    Integrates an initial value problem exactly as scipy.integrate.solve_ivp(fun, t_span, y0, t_eval=t_eval, ...)
+    would, but yields the solution at t_eval in successive pieces while stepping, instead of collecting all of it.
+    Memory use is therefore bounded by chunk_size rather than by the length of t_eval.
+
+    :param fun: The right-hand side of the system, fun(t, y).
+    :type fun: callable
+    :param t_span: The interval of integration (t0, tf).
+    :type t_span: tuple
+    :param y0: The initial state.
+    :type y0: array_like
+    :param t_eval: The (sorted) times at which to store the solution, within t_span.
+    :type t_eval: array_like
+    :param method: The integration method, one of 'RK23', 'RK45', 'DOP853', 'Radau', 'BDF' and 'LSODA'. Default is 'RK45'.
+    :type method: str
+    :param chunk_size: The maximum number of times per yielded piece. Default is no limit (one piece per solver step).
+    :type chunk_size: int
+    :param stats: A dictionary in which to accumulate the solver statistics (see :data:`STATS`), e.g. over the
+        segments of a piecewise integration. Default is None (not recorded).
+    :type stats: dict
+    :param options: Options passed on to the solver (e.g. jac, rtol, atol).
+    :return: A generator of the solution at successive times of t_eval, as arrays of shape (n, k).
+    :rtype: generator
+    :raises ValueError: If the method is unknown.
+    :raises RuntimeError: If the integration fails.
+    """
+    t_eval = np.asarray(t_eval)
+    stored = 0
+    for solver in _steps(fun, t_span, y0, method, stats, **options):
+        reached = np.searchsorted(t_eval, solver.t, side='right')
+        if reached > stored:
+            sol = solver.dense_output()
+            step = chunk_size or reached - stored
+            for start in range(stored, reached, step):
+                yield sol(t_eval[start:min(start + step, reached)])
+            stored = reached
+
+
+def dense_ivp(fun, t_span, y0, method='RK45', stats=None, **options):
+    """
+    Integrates an initial value problem like :func:`stream_ivp`, but keeps the solver's interpolant of every step
+    instead of evaluating the solution at given times, as scipy.integrate.solve_ivp(..., dense_output=True) would.
+    Memory use is therefore bounded by the number of solver steps.
+
+    :param fun: The right-hand side of the system, fun(t, y).
+    :type fun: callable
+    :param t_span: The interval of integration (t0, tf).
+    :type t_span: tuple
+    :param y0: The initial state.
+    :type y0: array_like
+    :param method: The integration method (see :func:`stream_ivp`). Default is 'RK45'.
+    :type method: str
+    :param stats: A dictionary in which to accumulate the solver statistics (see :func:`stream_ivp`). Default is None.
+    :type stats: dict
+    :param options: Options passed on to the solver (e.g. jac, rtol, atol).
+    :return: The continuous solution, callable on times within t_span (with attribute ts, the step times).
+    :rtype: scipy.integrate.OdeSolution
+    :raises ValueError: If the method is unknown.
+    :raises RuntimeError: If the integration fails.
+    """
+    ts, interpolants = [t_span[0]], []
+    for solver in _steps(fun, t_span, y0, method, stats, **options):
+        ts.append(solver.t)
+        interpolants.append(solver.dense_output())
+    return scipy.integrate.OdeSolution(ts, interpolants)
+
+
+def _steps(fun, t_span, y0, method, stats, **options):
+    # steps the solver, yielding it after every step, and accumulates its statistics into stats
+    if method not in METHODS:
+        raise ValueError(f"The integration method must be one of {list(METHODS)}.")
+    solver = METHODS[method](fun, t_span[0], y0, t_span[1], **options)
+    stats = {} if stats is None else stats
+    for key in STATS:
+        stats.setdefault(key, 0)
+    n_stages = getattr(solver, 'n_stages', None)     # explicit Runge-Kutta methods only
+
+    try:
+        while solver.status == 'running':
+            nfev = solver.nfev
+            message = solver.step()
+            if solver.status == 'failed':
+                raise RuntimeError(f"Integration with {method} failed at t = {solver.t}: {message}")
+            stats['n_steps'] += 1
+            if n_stages:
+                # every attempted step costs n_stages evaluations; all but the last attempt were rejected
+                stats['n_rejected'] += max((solver.nfev - nfev) // n_stages - 1, 0)
+            yield solver
+    finally:
+        stats['nfev'] += int(solver.nfev)
+        stats['njev'] += int(solver.njev)
+        stats['nlu'] += int(solver.nlu)
+
+
+class DenseSolution:
+    """
+    This class represents a solution that is continuous in time, pieced together from segments (e.g. between dosing
+    events), each with its own interpolant or closed-form solution. It is evaluated lazily, at any times.
+
+    :param segments: The segments, in time order, as (start, end, evaluate, knots) tuples, with evaluate(times)
+        returning the state at the given times within [start, end] (of shape (n, len(times))), and knots the times
+        (including start and end) between which evaluate is smooth, e.g. the solver steps.
+    :type segments: list
+
+    :ivar float t_min: The start of the solution.
+    :ivar float t_max: The end of the solution.
+
+    :Usage Example:
+
+    >>> solution = model.solve_dense()
+    >>> solution([0.5, 1.5, 3600.25])   # shape (n_compartments, 3)
+    """
+    def __init__(self, segments):
+        self.segments = segments
+        self.starts = np.array([segment[0] for segment in segments], dtype=float)
+        self.t_min, self.t_max = segments[0][0], segments[-1][1]
+
+    @property
+    def knots(self):
+        """
+        The times between which the solution is smooth, over all segments.
+
+        :rtype: numpy.ndarray
+        """
+        return np.unique(np.concatenate([segment[3] for segment in self.segments]))
+
+    def __call__(self, times):
+        """
+        Evaluates the solution at the given times. At the boundary between two segments, the later segment is used
+        (i.e. the state just after a bolus).
+
+        :param times: The time (or array of times).
+        :type times: float or array_like
+        :return: The state, of shape (n,) for a single time or (n, len(times)).
+        :rtype: numpy.ndarray
+        :raises ValueError: If a time is outside of [t_min, t_max].
+        """
+        times = np.asarray(times, dtype=float)
+        flat = np.atleast_1d(times)
+        if flat.size and (flat.min() < self.t_min or flat.max() > self.t_max):
+            raise ValueError(f"The solution is only defined for times within [{self.t_min}, {self.t_max}].")
+        index = np.clip(np.searchsorted(self.starts, flat, side='right') - 1, 0, len(self.segments) - 1)
+        values = None
+        for i in np.unique(index):
+            mask = index == i
+            piece = np.asarray(self.segments[i][2](flat[mask]))
+            if values is None:
+                values = np.empty((piece.shape[0], flat.size))
+            values[:, mask] = piece
+        if values is None:
+            values = np.empty((len(self.segments[0][2](np.array([self.t_min]))), 0))
+        return values[:, 0] if times.ndim == 0 else values
@@ -0,0 +1,165 @@
+import numpy as np
+
+SUMMARY_CHUNK_SIZE = 100000     # number of timesteps read at once by summarize
+
+
+class MetricsAccumulator:
+    """
+    This class computes pharmacokinetic summary metrics of timeseries in a single pass, from successive windows of
+    timesteps (e.g. as yielded by :meth:`Model.solve_chunks`, or read from a memory-mapped results file), so that the
+    whole timeseries never has to be in memory. All metrics are computed with vectorized reductions over the last
+    (time) axis, for any number of leading (compartment, individual) dimensions:
+
+    - 'auc': The area under the curve, by the trapezoidal rule.
+    - 'cmax', 'tmax': The maximum level and the (first) time at which it is reached.
+    - 'trough': The minimum level after the maximum (NaN if the maximum is reached at the last timestep).
+    - 'half_life': The terminal half-life, from a log-linear fit to the positive levels in the last terminal_fraction
+      of the timeseries (NaN if the levels are not decreasing there).
+    - 'time_above': The time spent above the threshold (only if a threshold is given).
+
+    :param n_times: The total number of timesteps (used to locate the terminal phase).
+    :type n_times: int
+    :param step: The time between timesteps. Default is 1.
+    :type step: float
+    :param start: The time of the first timestep. Default is 0.
+    :type start: float
+    :param volumes: Volumes by which to divide the amounts, to compute the metrics of concentrations instead.
+        Must broadcast against the leading dimensions of the windows, e.g. of shape (n_compartments,). Default is None.
+    :type volumes: array_like
+    :param threshold: The level for 'time_above'. Default is None.
+    :type threshold: float
+    :param terminal_fraction: The fraction of the timeseries that makes up the terminal phase. Default is 0.25.
+    :type terminal_fraction: float
+
+    :Usage Example:
+
+    >>> accumulator = MetricsAccumulator(model.time_span, volumes=model.parameter_table()['volume'])
+    >>> for times, window in model.solve_chunks(chunk_size=10000, save=False):
+    ...     accumulator.update(np.stack(list(window.values())))
+    >>> accumulator.result()['cmax']    # one per compartment
+    """
+    def __init__(self, n_times, step=1.0, start=0.0, volumes=None, threshold=None, terminal_fraction=0.25):
+        self.n_times, self.step, self.start = n_times, step, start
+        self.volumes = None if volumes is None else np.asarray(volumes, dtype=float)
+        self.threshold = threshold
+        self.terminal_start = min(int(n_times * (1 - terminal_fraction)), max(n_times - 2, 0))
+        self.n_seen = 0
+
+    def update(self, window):
+        """
+        Adds the next window of timesteps.
+
+        :param window: The levels, of shape (..., k), for the next k timesteps.
+        :type window: array_like
+        """
+        window = np.asarray(window, dtype=float)
+        if self.volumes is not None:
+            window = window / self.volumes[..., None]
+        k = window.shape[-1]
+        if k == 0:
+            return
+        index = self.n_seen + np.arange(k)
+        if self.n_seen == 0:
+            batch = window.shape[:-1]
+            self.first = window[..., 0].copy()
+            self.total, self.above = np.zeros(batch), np.zeros(batch, dtype=int)
+            self.cmax, self.peak, self.trough = np.full(batch, -np.inf), np.zeros(batch, dtype=int), np.full(batch, np.inf)
+            self.fit = np.zeros((5,) + batch)   # sums of 1, t, t^2, log(c) and t log(c) over the terminal phase
+        self.last = window[..., -1].copy()
+        self.total += window.sum(axis=-1)
+
+        # the maximum, and the minimum since the maximum
+        argmax = window.argmax(axis=-1)
+        wmax = np.take_along_axis(window, argmax[..., None], axis=-1)[..., 0]
+        better = wmax > self.cmax
+        after_peak = np.where(np.arange(k) > argmax[..., None], window, np.inf).min(axis=-1)
+        self.trough = np.where(better, after_peak, np.minimum(self.trough, window.min(axis=-1)))
+        self.cmax = np.where(better, wmax, self.cmax)
+        self.peak = np.where(better, self.n_seen + argmax, self.peak)
+
+        if self.threshold is not None:
+            self.above += (window > self.threshold).sum(axis=-1)
+
+        # terminal phase, with times relative to its start (for numerical stability)
+        if index[-1] >= self.terminal_start:
+            t = (index - self.terminal_start) * self.step
+            use = (index >= self.terminal_start) & (window > 0)
+            log = np.log(np.where(use, window, 1.0))
+            self.fit += np.stack([use.sum(axis=-1), (use * t).sum(axis=-1), (use * t ** 2).sum(axis=-1),
+                                  (use * log).sum(axis=-1), (use * t * log).sum(axis=-1)])
+        self.n_seen += k
+
+    def result(self):
+        """
+        Returns the metrics of the timeseries seen so far.
+
+        :return: A dictionary mapping each metric name to an array of the leading dimensions of the windows.
+        :rtype: dict
+        :raises ValueError: If no timesteps have been added.
+        """
+        if self.n_seen == 0:
+            raise ValueError("No timesteps have been added.")
+        count, t, tt, log, tlog = self.fit
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (count * tlog - t * log) / (count * tt - t ** 2)
+            half_life = np.where((count >= 2) & (slope < 0), np.log(2) / -slope, np.nan)
+        metrics = {'auc': self.step * (self.total - (self.first + self.last) / 2),
+                   'cmax': self.cmax,
+                   'tmax': self.start + self.step * self.peak,
+                   'trough': np.where(np.isinf(self.trough), np.nan, self.trough),
+                   'half_life': half_life}
+        if self.threshold is not None:
+            metrics['time_above'] = self.step * self.above
+        return metrics
+
+
+def summarize(data, step=1.0, start=0.0, volumes=None, threshold=None, terminal_fraction=0.25,
+              chunk_size=SUMMARY_CHUNK_SIZE):
+    """
+    Computes the pharmacokinetic summary metrics (see :class:`MetricsAccumulator`) of solved timeseries in one pass,
+    reading chunk_size timesteps at a time (so that memory-mapped results are never loaded in full).
+
+    :param data: A dictionary containing the timeseries for each compartment (as returned by :meth:`Model.solve` or
+        :func:`load_timeseries`), or an array of timeseries with time along the last axis (e.g. of shape
+        (n_individuals, n_compartments, n_timesteps), as returned by :meth:`Model.solve_population`).
+    :type data: dict or numpy.ndarray
+    :param step: The time between timesteps. Default is 1.
+    :type step: float
+    :param start: The time of the first timestep. Default is 0.
+    :type start: float
+    :param volumes: Volumes by which to divide the amounts, to compute the metrics of concentrations instead: for a
+        dictionary, one per compartment (as a dictionary or in the order of data); for an array, broadcastable to its
+        leading dimensions (e.g. model.parameter_table()['volume'] for a population). Default is None.
+    :type volumes: dict or array_like
+    :param threshold: The level for the 'time_above' metric. Default is None (not computed).
+    :type threshold: float
+    :param terminal_fraction: The fraction of the timeseries that makes up the terminal phase. Default is 0.25.
+    :type terminal_fraction: float
+    :param chunk_size: The number of timesteps read at once. Default is 100000.
+    :type chunk_size: int
+    :return: For a dictionary, a dictionary containing the metrics (as a dictionary of floats) for each compartment;
+        for an array, a dictionary mapping each metric name to an array of its leading dimensions.
+    :rtype: dict
+
+    :Usage Example:
+
+    >>> timeseries = model.solve()
+    >>> summarize(timeseries, volumes=model.parameter_table()['volume'], threshold=0.5)['Liver']['cmax']
+    """
+    if isinstance(data, dict):
+        names = list(data)
+        if isinstance(volumes, dict):
+            volumes = [volumes[name] for name in names]
+        n_times = len(data[names[0]]) if names else 0
+        read = lambda first, last: np.stack([data[name][first:last] for name in names])
+    else:
+        n_times = data.shape[-1]
+        read = lambda first, last: data[..., first:last]
+
+    accumulator = MetricsAccumulator(n_times, step, start, volumes, threshold, terminal_fraction)
+    for first in range(0, n_times, chunk_size):
+        accumulator.update(read(first, first + chunk_size))
+    metrics = accumulator.result()
+    if isinstance(data, dict):
+        return {name: {metric: float(value[i]) for metric, value in metrics.items()} for i, name in enumerate(names)}
+    return metrics
@@ -1,10 +1,184 @@
-import scipy, os, pickle
-import matplotlib.pyplot as plt 
+import scipy, os, json, hashlib, time, contextlib, copy, warnings
+import scipy.linalg, scipy.sparse, scipy.sparse.linalg
 import numpy as np
 import datetime
 
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from .system_parser import Parser
+from .system_parser import Parser, compile_dose_expression
+from .analytic import propagate, propagate_sensitivities
+from .integrate import stream_ivp, dense_ivp, DenseSolution, STATS
+from .results import MAGIC, ResultsReader, ResultsWriter, unique_results_path
+from .plotting import decimate_minmax
+
+IMPLICIT_METHODS = ('BDF', 'Radau', 'LSODA')   # solve_ivp methods that make use of a Jacobian
+POPULATION_PARAMETERS = ('volume', 'rate_in', 'rate_out', 'initial_amount')
+STREAM_CHUNK_SIZE = 100000      # default number of timesteps per window of a streamed solution
+STIFFNESS_THRESHOLD = 1000      # stiffness ratio above which method='auto' selects an implicit solver
+SOLVE_HOOKS = []                # callables hook(model, stats), called after every Model.solve (see Model.solve_stats)
+SENSITIVITY_PARAMETERS = ('volume', 'rate_in', 'rate_out')   # default parameters of Model.sensitivities
+SPARSE_THRESHOLD = 200          # number of compartments from which the right-hand side and Jacobian are kept sparse
+DENSE_KNOTS_PER_DECADE = 16     # knots per decade of time after a segment start of the closed-form dense solution
+PARAMETER_ARRAYS = {'volume': 'volumes', 'rate_in': 'rates_in', 'rate_out': 'rates_out',
+                    'initial_amount': 'initial_amounts'}    # compartment parameters and the Model arrays holding them
+
+def assemble_rate_matrix(volumes, rates_in, rates_out, is_subcutaneous, edges=()):
+    """
+    Assembles the rate matrix A of the linear compartment system, such that the amounts y
+    evolve as dy/dt = A y + b dose(t) (see also :func:`assemble_dose_vector`).
+    Parameters may carry leading (batch) dimensions, in which case one matrix is returned per batch entry.
+    See :func:`assemble_sparse_rate_matrix` for a single, sparse rate matrix.
+
+    :param volumes: The compartment volumes, in the order central, peripheral (any number), subcutaneous (if present).
+    :type volumes: array_like
+    :param rates_in: The compartment rates_in (only used for peripheral compartments), in the same order.
+    :type rates_in: array_like
+    :param rates_out: The compartment rates_out (only used for central and subcutaneous compartments), in the same order.
+    :type rates_out: array_like
+    :param is_subcutaneous: Whether the last compartment is a subcutaneous one.
+    :type is_subcutaneous: bool
+    :param edges: Additional directed flows, as (source index, target index, rate) tuples. Default is none.
+    :type edges: list
+    :return: The rate matrix, of shape (..., n_compartments, n_compartments).
+    :rtype: numpy.ndarray
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    rates_in = np.broadcast_to(np.asarray(rates_in, dtype=float), volumes.shape)
+    rates_out = np.broadcast_to(np.asarray(rates_out, dtype=float), volumes.shape)
+    n = volumes.shape[-1]
+    peripheral = np.arange(1, n - 1 if is_subcutaneous else n)
+
+    # exchange between central and peripheral compartments
+    k = rates_in[..., peripheral]
+    A = np.zeros(volumes.shape + (n,))
+    A[..., peripheral, 0] = k / volumes[..., :1]
+    A[..., peripheral, peripheral] = -k / volumes[..., peripheral]
+    A[..., 0, peripheral] = k / volumes[..., peripheral]
+    A[..., 0, 0] = -(rates_out[..., 0] + k.sum(axis=-1)) / volumes[..., 0]
+    # absorption from the subcutaneous compartment
+    if is_subcutaneous:
+        A[..., 0, -1] = rates_out[..., -1]
+        A[..., -1, -1] = -rates_out[..., -1]
+    # additional flows between compartments
+    for source, target, rate in edges:
+        flow = rate / volumes[..., source]
+        A[..., target, source] += flow
+        A[..., source, source] -= flow
+    return A
+
+def assemble_sparse_rate_matrix(volumes, rates_in, rates_out, is_subcutaneous, edges=()):
+    """
+    Assembles the same rate matrix as :func:`assemble_rate_matrix`, for a single model, as a sparse matrix
+    whose size scales with the number of compartments and edges rather than with its square.
+
+    :param volumes: The compartment volumes, in the order central, peripheral (any number), subcutaneous (if present).
+    :type volumes: array_like
+    :param rates_in: The compartment rates_in (only used for peripheral compartments), in the same order.
+    :type rates_in: array_like
+    :param rates_out: The compartment rates_out (only used for central and subcutaneous compartments), in the same order.
+    :type rates_out: array_like
+    :param is_subcutaneous: Whether the last compartment is a subcutaneous one.
+    :type is_subcutaneous: bool
+    :param edges: Additional directed flows, as (source index, target index, rate) tuples. Default is none.
+    :type edges: list
+    :return: The rate matrix, of shape (n_compartments, n_compartments).
+    :rtype: scipy.sparse.csr_matrix
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    rates_in = np.broadcast_to(np.asarray(rates_in, dtype=float), volumes.shape)
+    rates_out = np.broadcast_to(np.asarray(rates_out, dtype=float), volumes.shape)
+    n = volumes.size
+    peripheral = np.arange(1, n - 1 if is_subcutaneous else n)
+    central = np.zeros_like(peripheral)
+
+    # (row, column, value) triplets; duplicates are summed
+    k = rates_in[peripheral]
+    rows = [peripheral, peripheral, central, [0]]
+    columns = [central, peripheral, peripheral, [0]]
+    values = [k / volumes[0], -k / volumes[peripheral], k / volumes[peripheral], [-(rates_out[0] + k.sum()) / volumes[0]]]
+    if is_subcutaneous:
+        rows += [[0], [n - 1]]
+        columns += [[n - 1], [n - 1]]
+        values += [[rates_out[-1]], [-rates_out[-1]]]
+    if len(edges):
+        source, target, rate = (np.array(column) for column in zip(*edges))
+        flow = rate / volumes[source.astype(int)]
+        rows += [target, source]
+        columns += [source, source]
+        values += [flow, -flow]
+    A = scipy.sparse.coo_matrix((np.concatenate(values), (np.concatenate(rows).astype(int),
+                                                          np.concatenate(columns).astype(int))), shape=(n, n)).tocsr()
+    A.eliminate_zeros()
+    return A
+
+def stiffness_ratio(rate_matrix, time_span):
+    """
+    Estimates the stiffness of the linear compartment system as the ratio of its fastest to its slowest time scale,
+    from the spread of the eigenvalues of the rate matrix. Time scales longer than the time span are not resolved
+    by the solution, so they count as the time span. For a stack of rate matrices, the largest ratio is returned.
+    For a sparse rate matrix, no dense eigendecomposition is computed: only the eigenvalue of largest magnitude and
+    the eigenvalues nearest to 1 / time_span (by shift-invert) are computed iteratively, and if they do not converge,
+    the fastest rate is bounded by the Gershgorin discs of the columns and the slowest taken as 1 / time_span.
+
+    :param rate_matrix: The rate matrix, of shape (..., n_compartments, n_compartments), or a sparse rate matrix.
+    :type rate_matrix: array_like or scipy.sparse.spmatrix
+    :param time_span: The time span of the solution.
+    :type time_span: float
+    :return: The stiffness ratio (0 if the system has no dynamics).
+    :rtype: float
+    """
+    if scipy.sparse.issparse(rate_matrix):
+        A = scipy.sparse.csc_matrix(rate_matrix)
+        try:
+            fastest = np.abs(scipy.sparse.linalg.eigs(A, k=1, which='LM', return_eigenvectors=False).real).max()
+        except (scipy.sparse.linalg.ArpackNoConvergence, RuntimeError):
+            fastest = abs(A).sum(axis=0).max()     # the largest Gershgorin disc of the columns reaches furthest from 0
+        try:
+            slow = scipy.sparse.linalg.eigs(A, k=min(6, A.shape[0] - 2), sigma=1 / time_span,
+                                            return_eigenvectors=False)
+            rates = np.abs(slow.real)
+            slowest = max(np.min(rates[rates > 0], initial=np.inf), 1 / time_span)
+        except (scipy.sparse.linalg.ArpackNoConvergence, RuntimeError):
+            slowest = 1 / time_span
+        return float(fastest / slowest)
+    rates = np.abs(np.linalg.eigvals(rate_matrix).real)
+    slowest = np.maximum(np.min(np.where(rates > 0, rates, np.inf), axis=-1), 1 / time_span)
+    return float(np.max(np.max(rates, axis=-1) / slowest))
+
+def assemble_dose_vector(n_compartments, is_subcutaneous):
+    """
+    Assembles the input vector b of the linear compartment system, which routes the dose
+    into the subcutaneous compartment (if present) or else into the central compartment.
+
+    :param n_compartments: The number of compartments in the model.
+    :type n_compartments: int
+    :param is_subcutaneous: Whether the last compartment is a subcutaneous one.
+    :type is_subcutaneous: bool
+    :return: The input vector, of shape (n_compartments,).
+    :rtype: numpy.ndarray
+    """
+    b = np.zeros(n_compartments)
+    b[-1 if is_subcutaneous else 0] = 1.0
+    return b
+
+def load_timeseries(path):
+    """
+    Loads the timeseries written by :meth:`Model.solve` or :meth:`Model.solve_chunks` (memory-mapped, see
+    :class:`ResultsReader`), or a pickle file of timeseries written by earlier versions of PKPy.
+
+    :param path: The path to the results (or pickle) file.
+    :type path: str
+    :return: A dictionary containing the timeseries for each compartment.
+    :rtype: dict
+    :raises ValueError: If a pickle file does not contain dictionaries.
+    """
+    with open(path, 'rb') as handle:
+        if handle.read(len(MAGIC)) == MAGIC:
+            return ResultsReader(path).to_dict()
+    import pickle       # only needed for legacy results
+    with open(path, 'rb') as handle:
+        timeseries = pickle.load(handle)
+    if type(timeseries) != dict:
+        raise ValueError(f"Pickle file '{path}' is not a dictionary.")
+    return timeseries
 
 class Compartment():
     """
@@ -37,6 +211,32 @@ class Compartment():
         self.rate_in = dict.get('rate_in', None)
         self.rate_out = dict['rate_out']
 
+class CompartmentView(Compartment):
+    """
+    A compartment of a model (see :attr:`Model.compartment_list`), whose parameters are read from the parameter arrays
+    of the model, and written through to them on assignment, e.g. `model.compartment_list[1].volume = 30`, which
+    reassembles the model as :meth:`Model.set_parameters` does. Its name and type cannot be changed.
+
+    :param model: The model.
+    :type model: Model
+    :param index: The position of the compartment in the state of the model.
+    :type index: int
+    """
+    def __init__(self, model, index):
+        self.__dict__.update(_model=model, _index=index, name=model.names[index],
+                             type=model._structure[index]['type'])
+
+    def __getattr__(self, attribute):
+        # only called for attributes not in __dict__, i.e. the parameters
+        if attribute in PARAMETER_ARRAYS:
+            return getattr(self._model, PARAMETER_ARRAYS[attribute])[self._index].item()
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{attribute}'")
+
+    def __setattr__(self, attribute, value):
+        if attribute not in PARAMETER_ARRAYS:
+            raise AttributeError(f"The {attribute} of compartment {self.name} cannot be changed.")
+        self._model._set_parameters_at({(self._index, attribute): value})
+
 class Model():
     """
     A class representing a pharmacokinetic model.
@@ -46,11 +246,30 @@ class Model():
     
     :ivar str dose_type: The type dosage schedule ('bolus' or 'continuous') or user-provided dosage function.
     :ivar float dose_constant: The dose constant (defaults to 10 if user provides a dosage function).
+    :ivar list dosing_schedule: Additional dosing events (dictionaries with keys 'time', 'amount', 'route' and 'duration'), sorted by time.
     
-    :ivar list compartment_list: A list of compartments in the model (as Compartment objects).
+    :ivar dict index_map: The canonical index map of the model state (see :meth:`Parser.build_index_map`).
+    :ivar list names: The compartment names, in state order.
+    :ivar numpy.ndarray volumes: The compartment volumes, in state order. Like the other parameter arrays, it is
+        read-only; use :meth:`set_parameters` to change the parameters.
+    :ivar numpy.ndarray rates_in: The compartment rates_in, in state order (0 where unset).
+    :ivar numpy.ndarray rates_out: The compartment rates_out, in state order (0 where unset).
+    :ivar numpy.ndarray initial_amounts: The initial amounts of substance, in state order.
+    :ivar list compartment_list: A list of compartments in the model (as Compartment objects whose parameters write
+        through to the parameter arrays).
     :ivar Compartment central: The central compartment.
     :ivar Compartment subcutaneous: The subcutaneous compartment (if present).
     :ivar list other_compartments: A list of other (peripheral) compartments (as Compartment objects) in the model.
+    :ivar list edges: Additional directed flows between compartments, as (source index, target index, rate) tuples.
+    :ivar numpy.ndarray rate_matrix: The rate matrix A of the linear system dy/dt = A y + b dose(t).
+    :ivar scipy.sparse.csr_matrix sparse_rate_matrix: The rate matrix A as a sparse matrix; used for the right-hand side
+        and the Jacobian of models with many compartments (see SPARSE_THRESHOLD).
+    :ivar numpy.ndarray dose_vector: The input vector b, routing the dose into its target compartment.
+    :ivar list config: The system configuration of the model (basic parameters and the current compartment
+        parameters, as returned by :meth:`Parser.construct`).
+    :ivar str config_hash: A hash of the inputs of a solve (the current dosing, time span, edges and parameters).
+    :ivar str results_path: The path of the results file written by the last solve (if any).
+    :ivar dict solve_stats: The statistics of the last solve (if any), see :meth:`solve`.
 
     :Usage Example:
 
@@ -64,50 +283,222 @@ class Model():
         the ODE system in the form of compartments of particular types ("central", 
         "subcutaneous" or "peripheral") with associated rates, volumes and initial amounts).
 
-        :param systemfile: The path to the system file.
-        :type systemfile: str
+        :param systemfile: The path to the system file, or the system configuration as a dictionary in the same layout.
+        :type systemfile: str or dict
         """
         parser = Parser(systemfile)
         basic_params, compartments = parser.construct()
+        name = 'config' if isinstance(systemfile, dict) else systemfile.split('/')[-1].split('.')[0]
+        self._build(name, basic_params, compartments, parser.index_map)
+
+    @classmethod
+    def from_config(cls, basic_params, compartments, name='config'):
+        """
+        Creates a Model object directly from an already constructed system configuration
+        (as returned by :meth:`Parser.construct`), without reading a system file.
+
+        :param basic_params: The model's basic parameters.
+        :type basic_params: dict
+        :param compartments: The individual compartment parameters, sorted as by :meth:`Parser.construct`.
+        :type compartments: list
+        :param name: The name under which to register the model (in place of the system file name). Default is 'config'.
+        :type name: str
+        :return: The model.
+        :rtype: Model
+        """
+        model = cls.__new__(cls)
+        model._build(name, basic_params, compartments)
+        return model
 
+    def _build(self, name, basic_params, compartments, index_map=None):
         # basic parameters
-        self.systemfile = systemfile.split('/')[-1].split('.')[0]
+        self.systemfile = name
         self.initiation_time = datetime.datetime.now().strftime("%Y_%m_%d-%H_%M_%S") # time of model initiation
         self.is_subcutaneous = basic_params['subcutaneous']         # boolean
         self.time_span = basic_params['time_span']                  # int
-        if not isinstance(basic_params['dose'], str):
+        if 'dose' not in basic_params:
+            self.dose_constant, self.dose_type = 0, 'continuous'    # dosing only by the dosing schedule
+        elif not isinstance(basic_params['dose'], str):
             self.dose_constant = basic_params['dose'][0]            # amount
             self.dose_type = basic_params['dose'][1]                # dosage schedule
         else:
             self.dose_type = basic_params['dose']                   # user-provided dosage function
             self.dose_constant = 10
+        self.dosing_schedule = sorted(basic_params.get('dosing_schedule', []), key=lambda event: event['time'])
+        # the configuration without the compartment parameters, which are held only by the parameter arrays below
+        self._basic_params = copy.deepcopy(basic_params)
+        self._structure = [{key: value for key, value in copy.deepcopy(compartment).items()
+                            if key not in PARAMETER_ARRAYS} for compartment in compartments]
 
-        # create compartment objects
-        self.compartment_list = [Compartment(dict) for dict in compartments]
-        if self.is_subcutaneous:
-            self.central = self.compartment_list[0]
-            self.subcutaneous = self.compartment_list[-1]
-            self.other_compartments = self.compartment_list[1:-1]
-        else:
-            self.central, *self.other_compartments = self.compartment_list
+        # the compartment parameters as contiguous arrays, in the canonical state order (see Parser.build_index_map)
+        self.index_map = Parser.build_index_map(compartments) if index_map is None else index_map
+        self.names = list(self.index_map['names'])
+        self._peripheral = slice(self.index_map['peripheral'][0], self.index_map['peripheral'][-1] + 1) \
+            if self.index_map['peripheral'] else slice(0, 0)
+        as_float = lambda value: 0.0 if value is None else float(value)
+        for key, attribute in PARAMETER_ARRAYS.items():
+            setattr(self, attribute, np.array([as_float(compartment[key]) for compartment in compartments]))
+
+        # resolve the edges to indices in the state (the Parser ensures that their names are unique)
+        index = {name: i for i, name in enumerate(self.names)}
+        self.edges = [(index[edge['from']], index[edge['to']], edge['rate']) for edge in basic_params.get('edges', [])]
+
+        self._assemble()
+
+    @property
+    def config(self):
+        """
+        The system configuration of the model (basic parameters and compartment parameters, as returned by
+        :meth:`Parser.construct`), with the current values of the parameter arrays.
+        """
+        compartments = [dict(structure, **{key: getattr(self, attribute)[i].item()
+                                           for key, attribute in PARAMETER_ARRAYS.items()})
+                        for i, structure in enumerate(self._structure)]
+        return [copy.deepcopy(self._basic_params), compartments]
+
+    @property
+    def compartment_list(self):
+        """
+        The compartments of the model, in the canonical state order, as Compartment objects whose parameters are
+        read from the parameter arrays, and changed by assignment (see :meth:`set_parameters`).
+        """
+        return [CompartmentView(self, i) for i in range(len(self.names))]
+
+    @property
+    def central(self):
+        """
+        The central compartment, as a Compartment object (see :attr:`compartment_list`).
+        """
+        return CompartmentView(self, self.index_map['central'])
+
+    @property
+    def subcutaneous(self):
+        """
+        The subcutaneous compartment (if present), as a Compartment object (see :attr:`compartment_list`).
+        """
+        index = self.index_map['subcutaneous']
+        return None if index is None else CompartmentView(self, index)
+
+    @property
+    def other_compartments(self):
+        """
+        The peripheral compartments, as Compartment objects (see :attr:`compartment_list`).
+        """
+        return [CompartmentView(self, i) for i in self.index_map['peripheral']]
+
+    @property
+    def config_hash(self):
+        """
+        A hash of the inputs of a solve, computed from their current values (the dosing attributes, the time span,
+        the edges and the parameter arrays), so that it changes whenever any of them is changed after construction.
+        """
+        inputs = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                  for key, value in self._solve_inputs().items()}
+        return hashlib.sha256(json.dumps([self.names, self.is_subcutaneous, inputs], sort_keys=True,
+                                         default=float).encode()).hexdigest()
+
+    def _solve_inputs(self):
+        # the inputs of a solve that may be changed after construction: the dosing attributes, the time span,
+        # the edges and the parameter arrays
+        return {'dose_type': self.dose_type, 'dose_constant': self.dose_constant, 'time_span': self.time_span,
+                'dosing_schedule': self.dosing_schedule, 'edges': self.edges,
+                **{attribute: getattr(self, attribute) for attribute in PARAMETER_ARRAYS.values()}}
+
+    def _set_solve_inputs(self, inputs):
+        # sets the inputs of a solve (as returned by _solve_inputs, e.g. of another process) and reassembles the system
+        for key, value in inputs.items():
+            setattr(self, key, copy.deepcopy(value))
+        self._assemble()
+
+    @property
+    def rate_matrix(self):
+        """
+        The rate matrix A as a dense array, e.g. for the closed-form solution. For models with at least
+        SPARSE_THRESHOLD compartments it is assembled from :attr:`sparse_rate_matrix` only when first used.
+        """
+        if self._rate_matrix is None:
+            self._rate_matrix = self.sparse_rate_matrix.toarray()
+        return self._rate_matrix
+
+    def _assemble(self):
+        # assemble the linear system once, in the state order, and the index arrays of the per-compartment equations;
+        # the parameter arrays are read-only from here on, so that they can only be changed by set_parameters
+        for attribute in PARAMETER_ARRAYS.values():
+            getattr(self, attribute).setflags(write=False)
+        self.sparse_rate_matrix = assemble_sparse_rate_matrix(self.volumes, self.rates_in, self.rates_out,
+                                                              self.is_subcutaneous, self.edges)
+        # the dense rate matrix is only assembled on first use for models with many compartments (see rate_matrix)
+        self._rate_matrix = None if len(self.names) >= SPARSE_THRESHOLD else self.sparse_rate_matrix.toarray()
+        self._system_matrix = self.sparse_rate_matrix if self._rate_matrix is None else self._rate_matrix
+        self.dose_vector = assemble_dose_vector(len(self.names), self.is_subcutaneous)
+        edges = np.array(self.edges, dtype=float).reshape(-1, 3)
+        self._edge_source, self._edge_target = edges[:, 0].astype(int), edges[:, 1].astype(int)
+        self._edge_rates = edges[:, 2] / self.volumes[self._edge_source]
+
+    def copy(self):
+        """
+        Returns an independent copy of the model, which shares its (immutable) structure and read-only parameter
+        arrays, e.g. to change the parameters of many variants of one model (see :meth:`set_parameters`, which
+        replaces the arrays of the model it is called on).
+
+        :return: The copy.
+        :rtype: Model
+        """
+        return copy.copy(self)
+
+    def set_parameters(self, values):
+        """
+        Changes compartment parameters of the model in place, reassembling only the linear system (without parsing or
+        rebuilding the model), e.g. between the objective evaluations of a fit.
+
+        :param values: A dictionary mapping (compartment name, parameter) pairs to their new values, with parameter one
+            of 'volume', 'rate_in', 'rate_out' and 'initial_amount'.
+        :type values: dict
+        :raises ValueError: If a parameter is unknown, or its compartment name is not unique.
+        """
+        names = self.names
+        for name, _ in values:
+            if names.count(name) != 1:
+                raise ValueError(f"There must be exactly one compartment named '{name}'.")
+        self._set_parameters_at({(names.index(name), parameter): value for (name, parameter), value in values.items()})
+
+    def _set_parameters_at(self, values):
+        # changes parameters given by (compartment index, parameter) pairs, replacing the read-only parameter arrays
+        arrays = {attribute: getattr(self, attribute).copy() for attribute in PARAMETER_ARRAYS.values()}
+        for (index, parameter), value in values.items():
+            if parameter not in POPULATION_PARAMETERS:
+                raise ValueError(f"Unknown parameter '{parameter}'. Valid parameters are {list(POPULATION_PARAMETERS)}.")
+            arrays[PARAMETER_ARRAYS[parameter]][index] = 0.0 if value is None else value
+        for attribute, array in arrays.items():
+            setattr(self, attribute, array)
+        self._assemble()
+
+    def parameter_table(self):
+        """
+        Returns the compartment parameters as arrays, in the order of compartment_list (unset rates are 0).
+
+        :return: A dictionary with keys 'volume', 'rate_in', 'rate_out' and 'initial_amount', each an array of shape (n_compartments,).
+        :rtype: dict
+        """
+        return {key: getattr(self, attribute).copy() for key, attribute in PARAMETER_ARRAYS.items()}
 
     def dose(self,t):
         """
         Returns the dose at time t using dosage function specified by the user in the system config file. 
         The options are:
 
-        :param t: The time at which to calculate the dose.
-        :type t: float
-        :return: The dose at time t.
-        :rtype: float
+        :param t: The time (or array of times) at which to calculate the dose.
+        :type t: float or numpy.ndarray
+        :return: The dose at time t (an array of the same shape as t, if t is an array).
+        :rtype: float or numpy.ndarray
         """
         if self.dose_type == "continuous":
-            return self.dose_constant
+            return self.dose_constant if np.ndim(t) == 0 else np.full(np.shape(t), self.dose_constant, dtype=float)
         elif self.dose_type == "bolus":
-            return self.dose_constant if t == 0 else 0
+            # administered at time 0 as a jump of the state (see _schedule_segments), not as a rate
+            return 0.0 if np.ndim(t) == 0 else np.zeros(np.shape(t))
         else:
-            dosage_function = lambda x: eval(self.dose_type)
-            return dosage_function(t)
+            return compile_dose_expression(self.dose_type)(t)
     
     def ode_system(self, t, y):
         """
@@ -115,73 +506,797 @@ class Model():
 
         :param t: The current time.
         :type t: float
-        :param y: A list of the current amounts of substance in each compartment. The order of the compartments is as follows: central, peripheral (any number), subcutaneous (if present).
-        :type y: list
-        :return: A list of the derivatives of the amounts of substance in each compartment in the same order as the input y.
-        :rtype: list
+        :param y: The current amounts of substance in each compartment. The order of the compartments is the canonical state order (see :meth:`Parser.build_index_map`): central, peripheral (any number), subcutaneous (if present).
+        :type y: array_like
+        :return: The derivatives of the amounts of substance in each compartment in the same order as the input y.
+        :rtype: numpy.ndarray
         """
+        y = np.asarray(y, dtype=float)
+        V, central, peripheral = self.volumes, self.index_map['central'], self._peripheral
+        derivatives = np.empty_like(y)
+
+        # exchange of the peripheral compartments with the central one, computed in place (on a view of the output)
+        flows = derivatives[peripheral]
+        np.divide(y[peripheral], V[peripheral], out=flows)
+        np.subtract(y[central] / V[central], flows, out=flows)
+        np.multiply(self.rates_in[peripheral], flows, out=flows)
+        # elimination from the central compartment, and absorption from the subcutaneous compartment
         if self.is_subcutaneous:
-            central_amount, subcutaneous_amount = y[0], y[-1]
-            other_amounts = y[1:-1]
+            subcutaneous = self.index_map['subcutaneous']
+            absorption = self.rates_out[subcutaneous] * y[subcutaneous]
+            derivatives[central] = absorption - (y[central] * self.rates_out[central]) / V[central] - flows.sum()
+            derivatives[subcutaneous] = self.dose(t) - absorption
         else:
-            central_amount, *other_amounts = y
-            15.0, [3.0]
-
-        # calculate derivatives for peripheral compartments
-        derivatives = []
-        for amount, C in zip(other_amounts, self.other_compartments):
-            deriv = C.rate_in * (central_amount / self.central.volume - amount / C.volume)
-            derivatives.append(deriv)
-        # calculate derivative for subcutaneous and central compartments
-        if self.is_subcutaneous:
-            der_central = self.subcutaneous.rate_out * subcutaneous_amount - (central_amount * self.central.rate_out) /self.central.volume - sum(derivatives)
-            der_subcutaneous = self.dose(t) - self.subcutaneous.rate_out * subcutaneous_amount
-            return [der_central] + derivatives + [der_subcutaneous]
+            derivatives[central] = self.dose(t) - (y[central] * self.rates_out[central]) / V[central] - flows.sum()
+        # add the flows along the edges
+        if self.edges:
+            flow = self._edge_rates * y[self._edge_source]
+            np.add.at(derivatives, self._edge_target, flow)
+            np.subtract.at(derivatives, self._edge_source, flow)
+        return derivatives
+
+    def linear_ode_system(self, t, y):
+        """
+        The same system of ODEs as :meth:`ode_system`, evaluated in one step from the precompiled
+        rate matrix as dy/dt = A y + b dose(t).
+
+        :param t: The current time.
+        :type t: float
+        :param y: The current amounts of substance in each compartment, in the same order as for :meth:`ode_system`.
+        :type y: array_like
+        :return: The derivatives of the amounts of substance in each compartment in the same order as the input y.
+        :rtype: numpy.ndarray
+        """
+        return self._system_matrix @ y + self.dose_vector * self.dose(t)
+
+    def jacobian(self, t, y):
+        """
+        The (constant) Jacobian of :meth:`linear_ode_system`, i.e. the rate matrix
+        (sparse for models with at least SPARSE_THRESHOLD compartments).
+
+        :param t: The current time (unused).
+        :type t: float
+        :param y: The current amounts of substance in each compartment (unused).
+        :type y: array_like
+        :return: The rate matrix.
+        :rtype: numpy.ndarray or scipy.sparse.csr_matrix
+        """
+        return self._system_matrix
+
+    def analytic_solution(self, times, y0):
+        """
+        Evaluates the closed-form (matrix-exponential) solution of the model at the given times.
+        Only available for 'bolus' and 'continuous' dosing, for which the model is a linear time-invariant system.
+        A bolus is treated as the instantaneous administration of the dose constant at time 0.
+
+        :param times: The (non-negative) times at which to evaluate the solution.
+        :type times: array_like
+        :param y0: The initial amounts of substance in each compartment, in the same order as for :meth:`ode_system`.
+        :type y0: array_like
+        :return: The amounts of substance, of shape (n_compartments, len(times)).
+        :rtype: numpy.ndarray
+        :raises ValueError: If the model uses a custom dosage function.
+        """
+        y0 = np.array(y0, dtype=float) + self._bolus_dose()
+        return propagate(self.rate_matrix, self._linear_dosing(), y0, times)
+
+    def steady_state(self, interval=None, times=None):
+        """
+        Computes the steady state of the model directly, without integrating through the transient.
+
+        Without an interval, this is the state that constant ('continuous') dosing converges to, from the linear
+        system A y = -b dose (zero for 'bolus' dosing, and once all scheduled doses are eliminated).
+        With an interval, the dosing is repeated every interval: a 'bolus' dose at the start of each interval,
+        'continuous' dosing throughout, and the events of the dosing schedule that start within the first interval.
+        The amounts y* at the start of an interval (before its doses) then satisfy y* = P y* + c, with P = exp(A interval)
+        and c the amounts after one interval from none, i.e. (I - P) y* = c.
+
+        :param interval: The dosing interval, for the periodic steady state. Default is None (constant dosing).
+        :type interval: float
+        :param times: The times within [0, interval) at which to evaluate the periodic steady state, including the doses
+            given at those times (as by :meth:`solve`). Default is None (only the start of the interval, before its doses).
+        :type times: array_like
+        :return: A dictionary containing the steady-state amount of substance for each compartment, or (with times) the
+            amounts at the given times.
+        :rtype: dict
+        :raises ValueError: If the model uses a custom dosage function, if the interval is not positive, if an infusion
+            does not end within the interval, if times are given without an interval or are not sorted and within
+            [0, interval), or if the model has no steady state (e.g. without elimination).
+
+        :Usage Example:
+
+        >>> model.steady_state()['Bloodstream']     # under continuous infusion
+        >>> model.steady_state(interval=24, times=np.arange(24))['Bloodstream']     # over one dosing interval
+        """
+        u = self._linear_dosing()
+        if interval is None:
+            if times is not None:
+                raise ValueError("Times can only be given for the periodic steady state of a dosing interval.")
+            with np.errstate(all='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', scipy.sparse.linalg.MatrixRankWarning)
+                try:
+                    if scipy.sparse.issparse(self._system_matrix):
+                        y = scipy.sparse.linalg.spsolve(self._system_matrix.tocsc(), -u)
+                    else:
+                        y = np.linalg.solve(self.rate_matrix, -u)
+                except np.linalg.LinAlgError:
+                    y = np.full(u.shape, np.nan)
+            if not np.all(np.isfinite(y)):
+                raise ValueError("The model has no steady state (its rate matrix is singular).")
+            return dict(zip(self.names, y.tolist()))
+
+        if not interval > 0:
+            raise ValueError("The dosing interval must be positive.")
+        if any(event['time'] < interval < event['time'] + event['duration'] for event in self.dosing_schedule):
+            raise ValueError("The infusions of the dosing schedule must end within the dosing interval.")
+        times = np.zeros(0) if times is None else np.asarray(times, dtype=float)
+        if times.size and (np.any(np.diff(times) < 0) or times[0] < 0 or times[-1] >= interval):
+            raise ValueError("The times must be sorted and within [0, interval).")
+
+        # the amounts after one interval, from none, and the propagator of the interval
+        segments = self._schedule_segments(interval)
+        state = np.zeros(len(self.names))
+        for start, end, doses, infusion in segments:
+            state = propagate(self.rate_matrix, u + infusion, state + doses, [end - start])[:, 0]
+        with np.errstate(all='ignore'):
+            try:
+                y = np.linalg.solve(np.eye(state.size) - scipy.linalg.expm(self.rate_matrix * interval), state)
+            except np.linalg.LinAlgError:
+                y = np.full(state.shape, np.nan)
+        if not np.all(np.isfinite(y)):
+            raise ValueError("The model has no periodic steady state (it does not eliminate the drug).")
+        if not times.size:
+            return dict(zip(self.names, y.tolist()))
+
+        # the periodic steady state at the given times, segment by segment
+        amounts, state = [], y
+        for start, end, doses, infusion in segments:
+            state = state + doses
+            inside = times[(times >= start) & (times < end)]
+            amounts.append(propagate(self.rate_matrix, u + infusion, state, np.append(inside, end) - start))
+            state = amounts[-1][:, -1]
+            amounts[-1] = amounts[-1][:, :-1]
+        amounts = np.concatenate(amounts, axis=-1)
+        return dict(zip(self.names, amounts))
+
+    def _linear_dosing(self):
+        # constant input of the linear system with 'continuous' or 'bolus' dosing (the bolus is a jump of the state)
+        if self.dose_type == 'continuous':
+            return self.dose_constant * self.dose_vector
+        elif self.dose_type == 'bolus':
+            return np.zeros(len(self.names))
         else:
-            der_central = self.dose(t) - (central_amount * self.central.rate_out) / self.central.volume - sum(derivatives)
-            return [der_central] + derivatives
+            raise ValueError("An analytic solution is only available for 'bolus' or 'continuous' dosing.")
+
+    def _bolus_dose(self):
+        # the amounts administered at time 0 by 'bolus' dosing
+        return self.dose_constant * self.dose_vector if self.dose_type == 'bolus' else np.zeros(len(self.names))
+
+    def _iterate_schedule(self, t_eval, y0, segment_solver, chunk_size):
+        """
+        Integrates the model piecewise between the discontinuities of the dosing schedule (the dosing times and the
+        ends of infusions), and yields the solution in windows of fixed size. Boluses are added directly to the state,
+        and infusions enter as constant inputs, so that the solver is restarted at every discontinuity rather than
+        being forced to resolve it.
+
+        :param t_eval: The (sorted) times at which to store the solution.
+        :type t_eval: numpy.ndarray
+        :param y0: The initial state, of shape (..., n_compartments), or of shape (..., n_state) with the amounts
+            followed by further quantities (e.g. sensitivities), to which boluses are not added.
+        :type y0: array_like
+        :param segment_solver: A generator function (start, end, state, u, times) yielding the solution of the model
+            with additional constant input u, from state at time start, at the given times (ending at end), in pieces
+            of shape (..., n_compartments, k).
+        :type segment_solver: callable
+        :param chunk_size: The number of times per window.
+        :type chunk_size: int
+        :return: A generator of (times, solution) windows, the solution of shape (..., n_compartments, len(times)).
+        :rtype: generator
+        """
+        state = np.array(y0, dtype=float)
+        buffer, buffered, emitted = [], 0, 0
+        for start, end, bolus, u in self._schedule_segments():
+            state[..., :bolus.size] += bolus
+            first, last = np.searchsorted(t_eval, [start, end])
+            times = np.append(t_eval[first:last], end)
+
+            solved = 0
+            for states in segment_solver(start, end, state, u, times):
+                keep = min(states.shape[-1], times.size - 1 - solved)     # drop the state at the segment end
+                solved += states.shape[-1]
+                if keep > 0:
+                    buffer.append(states[..., :keep])
+                    buffered += keep
+                while buffered >= chunk_size:
+                    window = np.concatenate(buffer, axis=-1)
+                    yield t_eval[emitted:emitted + chunk_size], window[..., :chunk_size]
+                    buffer, buffered, emitted = [window[..., chunk_size:]], buffered - chunk_size, emitted + chunk_size
+            state = states[..., -1].copy()
+        if buffered > 0:
+            yield t_eval[emitted:], np.concatenate(buffer, axis=-1)
+
+    def _schedule_segments(self, span=None):
+        # the intervals between the discontinuities of the dosing schedule up to span (default time_span), as
+        # (start, end, bolus, u) tuples, with bolus the amounts administered at the start (including a 'bolus' dose at
+        # time 0) and u the constant infusion rates during the interval
+        span = self.time_span if span is None else span
+        targets = {'central': 0, 'subcutaneous': len(self.names) - 1}
+        breakpoints = {0, span}
+        for event in self.dosing_schedule:
+            if event['time'] < span:
+                breakpoints.update([event['time'], min(event['time'] + event['duration'], span)])
+        breakpoints = sorted(breakpoints)
+
+        segments = []
+        for start, end in zip(breakpoints[:-1], breakpoints[1:]):
+            bolus, u = self._bolus_dose() if start == 0 else np.zeros(len(self.names)), np.zeros(len(self.names))
+            for event in self.dosing_schedule:
+                if event['duration'] == 0 and event['time'] == start:
+                    bolus[targets[event['route']]] += event['amount']
+                elif event['time'] <= start < event['time'] + event['duration']:
+                    u[targets[event['route']]] += event['amount'] / event['duration']
+            segments.append((start, end, bolus, u))
+        return segments
 
-    def solve(self):
+    def select_method(self):
         """
-        Solves the system of ODEs using scipy.integrate.solve_ivp, returns the solutions,
-        and also writes them out to a pickle file in the results/ directory.
+        Selects an integration method from the stiffness of the model (see :func:`stiffness_ratio`):
+        the implicit 'BDF' method for stiff models, and the explicit 'RK45' method otherwise.
+
+        :return: The integration method.
+        :rtype: str
+        """
+        return 'BDF' if stiffness_ratio(self._system_matrix, self.time_span) > STIFFNESS_THRESHOLD else 'RK45'
+
+    def _integrator(self, engine, method, **tolerances):
+        # the integration method (with 'auto' resolved), right-hand side and solver options for the given engine
+        method = self.select_method() if method == 'auto' else method
+        if engine == 'matrix':
+            rhs = self.linear_ode_system
+            options = {'jac': self.jacobian} if method in IMPLICIT_METHODS else {}
+            if method == 'LSODA':
+                options['jac'] = lambda t, y: self.rate_matrix    # LSODA only accepts dense Jacobians
+        elif engine == 'compartment':
+            rhs, options = self.ode_system, {}
+        else:
+            raise ValueError("The engine must be either 'matrix' or 'compartment'.")
+        options.update(tolerances)
+        return method, rhs, options
+
+    def _segment_solver(self, engine, method, y0, chunk_size, stats=None, **tolerances):
+        # initial state and segment solver (see _iterate_schedule) for the given engine, method and tolerances;
+        # the solver statistics are accumulated in stats, if given
+        method, rhs, options = self._integrator(engine, method, **tolerances)
+        if method == 'analytic' and self.dose_type in ('bolus', 'continuous'):
+            u0 = self._linear_dosing()
+            def segment_solver(start, end, state, u, times):
+                for i in range(0, times.size, chunk_size):
+                    yield propagate(self.rate_matrix, u0 + u, state, times[i:i + chunk_size] - start)
+        else:
+            method = 'RK45' if method == 'analytic' else method
+            def segment_solver(start, end, state, u, times):
+                fun = (lambda t, y: rhs(t, y) + u) if u.any() else rhs
+                yield from stream_ivp(fun, [start, end], state, times, method=method, chunk_size=chunk_size,
+                                      stats=stats, **options)
+        if stats is not None:
+            stats['method'] = method
+        return y0, segment_solver
+
+    @contextlib.contextmanager
+    def _profiling(self, stats):
+        # times every evaluation of the right-hand side, and of the dose function within it, into stats
+        timed = {'dose': 0.0, 'rhs': 0.0}
+        def timer(function, name):
+            def timed_function(*args):
+                start = time.perf_counter()
+                try:
+                    return function(*args)
+                finally:
+                    timed[name] += time.perf_counter() - start
+            return timed_function
+        self.dose = timer(self.dose, 'dose')
+        self.ode_system = timer(self.ode_system, 'rhs')
+        self.linear_ode_system = timer(self.linear_ode_system, 'rhs')
+        try:
+            yield
+        finally:
+            del self.dose, self.ode_system, self.linear_ode_system
+            stats['dose_time'] = timed['dose']
+            stats['rhs_time'] = timed['rhs'] - timed['dose']
+
+    def _initial_amounts(self):
+        return self.initial_amounts.copy()
+
+    def solve(self, engine='matrix', method='RK45', save=True, cache=None, rtol=1e-3, atol=1e-6, max_step=np.inf,
+              profile=False, hooks=()):
+        """
+        Solves the system of ODEs with the solvers of scipy.integrate (see :func:`stream_ivp`), returns the solutions,
+        and also writes them out to a new results file in the results/ directory (unless save is False; see :class:`ResultsReader`).
+
+        The statistics of the run are kept in :attr:`solve_stats`, a dictionary with the keys
+
+        - 'engine', 'method': The engine and the integration method used (with 'auto' resolved).
+        - 'cache': 'hit' or 'miss' if a cache was given, None otherwise.
+        - 'nfev', 'njev', 'nlu': The number of evaluations of the right-hand side and the Jacobian, and of LU decompositions.
+        - 'n_steps', 'n_rejected': The number of accepted and rejected steps (rejected steps are only counted
+          for the explicit Runge-Kutta methods, and are None otherwise).
+        - 'dose_time', 'rhs_time': The time spent in :meth:`dose` and in the rest of the right-hand side
+          (only if profile is True).
+        - 'phase_times': The wall time of each phase ('cache', 'setup', 'integrate', 'write') and in 'total'.
+        - 'bytes_written': The size of the results file written (0 if save is False).
 
+        and are passed to every hook, and to every hook in the module-level list SOLVE_HOOKS, as hook(model, stats).
+
+        :param engine: The right-hand side to integrate: 'matrix' (precompiled rate matrix, default)
+            or 'compartment' (per-compartment formulation of :meth:`ode_system`).
+        :type engine: str
+        :param method: The integration method passed on to scipy.integrate.solve_ivp. Default is 'RK45'.
+            For the implicit methods ('BDF', 'Radau', 'LSODA') the 'matrix' engine supplies the analytic Jacobian.
+            Use 'analytic' to evaluate the closed-form solution for 'bolus' and 'continuous' dosing
+            (see :meth:`analytic_solution`); custom dosage functions then fall back to 'RK45'.
+            Use 'auto' to select 'BDF' for stiff models and 'RK45' otherwise (see :meth:`select_method`).
+            With a dosing schedule, the model is solved piecewise between dosing events.
+        :type method: str
+        :param save: Whether to write the solution to the results/ directory. Default is True.
+        :type save: bool
+        :param rtol: The relative tolerance of the integration. Default is 1e-3.
+        :type rtol: float
+        :param atol: The absolute tolerance of the integration. Default is 1e-6.
+        :type atol: float
+        :param max_step: The maximum step size of the integration. Default is np.inf (no limit).
+        :type max_step: float
+        :param cache: A cache of solutions, keyed on the model configuration and the solver options.
+            If given, a cached solution is returned instead of solving again. Default is None.
+        :type cache: SolutionCache
+        :param profile: Whether to time the evaluations of the dose and the right-hand side, at a small cost per
+            evaluation. Default is False.
+        :type profile: bool
+        :param hooks: Callables hook(model, stats) to call with the statistics of the run. Default is none.
+        :type hooks: list
         :return: A dictionary containing the timeseries for each compartment.
         :rtype: dict
+        :raises ValueError: If the engine is not 'matrix' or 'compartment'.
+
+        :Usage Example:
+
+        >>> model.solve(method='auto', save=False, hooks=[lambda model, stats: print(stats['nfev'])])
+        >>> model.solve_stats['phase_times']
         """
-        t_span = [0, self.time_span]
+        clock = time.perf_counter()
+        stats = {'engine': engine, 'method': method, 'cache': None, **dict.fromkeys(STATS, 0),
+                 'phase_times': {}, 'bytes_written': 0}
+        phase_times = stats['phase_times']
         t_eval = np.arange(0, self.time_span, 1)
+        tolerances = {'rtol': rtol, 'atol': atol, 'max_step': max_step}
+        compartment_timeseries = None
+        if cache is not None:
+            key = cache.key(self.config_hash, engine=engine, method=method, **tolerances)
+            compartment_timeseries = cache.get(key)
+            stats['cache'] = 'miss' if compartment_timeseries is None else 'hit'
+            phase_times['cache'] = time.perf_counter() - clock
 
-        # define initial conditions
-        if self.is_subcutaneous:
-            y0 = [self.central.initial_amount, self.subcutaneous.initial_amount]
-            y0.extend([c.initial_amount for c in self.other_compartments])
-        else:
-            y0 = [self.central.initial_amount]
-            y0.extend([c.initial_amount for c in self.other_compartments])
-
-        sol = scipy.integrate.solve_ivp(self.ode_system, t_span, y0, t_eval=t_eval, method='RK45')
+        if compartment_timeseries is None:
+            with self._profiling(stats) if profile else contextlib.nullcontext():
+                started = time.perf_counter()
+                y0, segment_solver = self._segment_solver(engine, method, self._initial_amounts(), STREAM_CHUNK_SIZE,
+                                                          stats=stats, **tolerances)
+                phase_times['setup'] = time.perf_counter() - started
+                started = time.perf_counter()
+                y = np.empty((len(self.names), t_eval.size))
+                for times, window in self._iterate_schedule(t_eval, y0, segment_solver, STREAM_CHUNK_SIZE):
+                    start = np.searchsorted(t_eval, times[0])
+                    y[:, start:start + times.size] = window
+                phase_times['integrate'] = time.perf_counter() - started
+            if stats['method'] not in ('RK23', 'RK45', 'DOP853'):
+                stats['n_rejected'] = None
 
-        compartment_timeseries = {}
-        for i, C in enumerate(self.compartment_list):
-            compartment_timeseries[C.name] = sol.y[i]
+            compartment_timeseries = dict(zip(self.names, y))
+            if cache is not None:
+                cache.put(key, compartment_timeseries)
+        elif save:
+            y = np.stack([compartment_timeseries[name] for name in self.names])
 
-        os.makedirs('results/', exist_ok=True)
-        with open(f'results/timeseries_{self.initiation_time}.pickle', 'wb') as f:
-            pickle.dump(compartment_timeseries, f)
+        if save:
+            started = time.perf_counter()
+            self.results_path = unique_results_path()
+            with ResultsWriter(self.results_path, self.names, t_eval.size,
+                               model_hash=self.config_hash) as writer:
+                writer.write(0, y)
+            stats['bytes_written'] = os.path.getsize(self.results_path)
+            phase_times['write'] = time.perf_counter() - started
 
         self.timeseries = compartment_timeseries
+        phase_times['total'] = time.perf_counter() - clock
+        self.solve_stats = stats
+        for hook in [*SOLVE_HOOKS, *hooks]:
+            hook(self, stats)
 
         return compartment_timeseries
 
+    def solve_chunks(self, chunk_size=STREAM_CHUNK_SIZE, engine='matrix', method='RK45', save=True,
+                     rtol=1e-3, atol=1e-6, max_step=np.inf):
+        """
+        Solves the model like :meth:`solve`, but yields the solution in windows of chunk_size timesteps while
+        integrating, and writes each window to a new results file in the results/ directory (unless save is False).
+        Memory use is bounded by the chunk size rather than by the time span.
+        The written file can be read back with :func:`load_timeseries`, which gives the same dictionary as :meth:`solve`.
+
+        :param chunk_size: The number of timesteps per window. Default is 100000.
+        :type chunk_size: int
+        :param engine: The right-hand side to integrate (see :meth:`solve`).
+        :type engine: str
+        :param method: The integration method (see :meth:`solve`).
+        :type method: str
+        :param save: Whether to write the solution to the results/ directory. Default is True.
+        :type save: bool
+        :param rtol: The relative tolerance of the integration. Default is 1e-3.
+        :type rtol: float
+        :param atol: The absolute tolerance of the integration. Default is 1e-6.
+        :type atol: float
+        :param max_step: The maximum step size of the integration. Default is np.inf (no limit).
+        :type max_step: float
+        :return: A generator of (times, timeseries) windows, with timeseries a dictionary of the window's
+            timeseries for each compartment.
+        :rtype: generator
+        :raises ValueError: If the engine is not 'matrix' or 'compartment'.
+
+        :Usage Example:
+
+        >>> model = Model('system.json')
+        >>> for times, window in model.solve_chunks(chunk_size=10000):
+        ...     print(times[0], window['Bloodstream'].max())
+        """
+        t_eval = np.arange(0, self.time_span, 1)
+        y0, segment_solver = self._segment_solver(engine, method, self._initial_amounts(), chunk_size,
+                                                  rtol=rtol, atol=atol, max_step=max_step)
+        windows = self._iterate_schedule(t_eval, y0, segment_solver, chunk_size)
+
+        if not save:
+            for times, window in windows:
+                yield times, dict(zip(self.names, window))
+            return
+        self.results_path = unique_results_path()
+        with ResultsWriter(self.results_path, self.names, t_eval.size,
+                           model_hash=self.config_hash) as writer:
+            for times, window in windows:
+                writer.write(np.searchsorted(t_eval, times[0]), window)
+                yield times, dict(zip(self.names, window))
+
+    def solve_dense(self, engine='matrix', method='RK45', rtol=1e-3, atol=1e-6, max_step=np.inf):
+        """
+        Solves the model like :meth:`solve`, but instead of evaluating the solution on the grid of timesteps, keeps it
+        as a continuous function of time: the interpolants of the solver steps, or the closed-form solution for
+        method='analytic'. Memory use is therefore bounded by the number of solver steps rather than by the time span.
+        The solution is kept as :attr:`dense_solution`, and can be queried at any times with :meth:`at`, which solves
+        it again with the same options if the dosing, time span or parameters of the model have changed since.
+
+        :param engine: The right-hand side to integrate (see :meth:`solve`).
+        :type engine: str
+        :param method: The integration method (see :meth:`solve`).
+        :type method: str
+        :param rtol: The relative tolerance of the integration. Default is 1e-3.
+        :type rtol: float
+        :param atol: The absolute tolerance of the integration. Default is 1e-6.
+        :type atol: float
+        :param max_step: The maximum step size of the integration. Default is np.inf (no limit).
+        :type max_step: float
+        :return: The continuous solution, of shape (n_compartments,) at a single time.
+        :rtype: DenseSolution
+        :raises ValueError: If the engine is not 'matrix' or 'compartment'.
+        """
+        dense_options = {'engine': engine, 'method': method, 'rtol': rtol, 'atol': atol, 'max_step': max_step}
+        method, rhs, options = self._integrator(engine, method, rtol=rtol, atol=atol, max_step=max_step)
+        analytic = method == 'analytic' and self.dose_type in ('bolus', 'continuous')
+        if analytic:
+            u0, state = self._linear_dosing(), self._initial_amounts()
+            rate_matrix = self.rate_matrix
+            # the closed form is a sum of exponentials exp(l t), which vary on the time scales 1/|l| and flatten out
+            # after them: knots spaced geometrically after each segment start, from a fraction of the fastest time
+            # scale to the end of the segment, so that their number grows only with the logarithm of its length
+            rates = np.abs(np.linalg.eigvals(rate_matrix))
+            fastest = 1 / rates.max() if rates.max() > 0 else np.inf
+        else:
+            method, state = 'RK45' if method == 'analytic' else method, np.array(self._initial_amounts(), dtype=float)
+
+        segments = []
+        for start, end, bolus, u in self._schedule_segments():
+            state = state + bolus
+            if analytic:
+                # closed form; smooth between the timesteps
+                def evaluate(times, start=start, state=state, u=u + u0):
+                    return propagate(rate_matrix, u, state, np.asarray(times) - start)
+                first = min(fastest, end - start) / 4
+                count = int(np.ceil(DENSE_KNOTS_PER_DECADE * np.log10((end - start) / first)))
+                knots = np.concatenate([[start], start + np.geomspace(first, end - start, count + 1)[:-1], [end]])
+            else:
+                fun = (lambda t, y, u=u: rhs(t, y) + u) if u.any() else rhs
+                evaluate = dense_ivp(fun, [start, end], state, method=method, **options)
+                knots = evaluate.ts
+            segments.append((start, end, evaluate, knots))
+            state = evaluate(np.array([end]))[:, 0]
+
+        self.dense_solution = DenseSolution(segments)
+        self._dense_key = self.config_hash
+        self._dense_options = dense_options
+        return self.dense_solution
+
+    def _current_dense_solution(self):
+        # the continuous solution, solved again (with the same options) if the inputs of the model have changed since
+        if getattr(self, '_dense_key', None) != self.config_hash:
+            self.solve_dense(**getattr(self, '_dense_options', {}))
+        return self.dense_solution
+
+    def at(self, times, compartments=None):
+        """
+        Evaluates the continuous solution of the model (see :meth:`solve_dense`) at arbitrary times.
+        If the model has not been solved with :meth:`solve_dense` yet, it is solved with the default options first;
+        if its dosing, time span or parameters have changed since, it is solved again with the same options.
+
+        :param times: The times, within [0, time_span].
+        :type times: float or array_like
+        :param compartments: The names of the compartments. Defaults to all compartments.
+        :type compartments: list
+        :return: A dictionary containing the amounts at the given times for each of the compartments.
+        :rtype: dict
+        :raises ValueError: If a time is outside of [0, time_span].
+        :raises KeyError: If there is no compartment of a given name.
+
+        :Usage Example:
+
+        >>> model.solve_dense(method='analytic')
+        >>> model.at([0.5, 86400.25], compartments=['Liver'])
+        """
+        dense_solution = self._current_dense_solution()
+        names = self.names
+        for name in compartments or []:
+            if name not in names:
+                raise KeyError(name)
+        values = dense_solution(times)
+        return {name: values[i] for i, name in enumerate(names) if compartments is None or name in compartments}
+
+    def exposure(self, compartments=None, start=0, end=None, subdivisions=4, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Computes the maximum amount (Cmax), the time at which it is reached (Tmax) and the area under the curve (AUC)
+        from the continuous solution of the model (see :meth:`solve_dense`), without evaluating the whole trajectory
+        at once. The solution is evaluated, chunk by chunk, at the knots (solver steps and dosing events, or times
+        spaced by the time scales of the model for the closed-form solution) and at the Gauss-Legendre nodes between
+        consecutive knots, by which the AUC is integrated (exactly, for the polynomial interpolants of the solvers of
+        up to that order).
+
+        :param compartments: The names of the compartments. Defaults to all compartments.
+        :type compartments: list
+        :param start: The start of the time window. Default is 0.
+        :type start: float
+        :param end: The end of the time window. Defaults to the time span.
+        :type end: float
+        :param subdivisions: The number of Gauss-Legendre nodes per interval between knots. Default is 4.
+        :type subdivisions: int
+        :param chunk_size: The maximum number of times evaluated at once. Default is 100000.
+        :type chunk_size: int
+        :return: A dictionary containing, for each of the compartments, a dictionary with keys 'cmax', 'tmax' and 'auc'.
+        :rtype: dict
+        :raises ValueError: If the time window is outside of [0, time_span].
+        """
+        end = self.time_span if end is None else end
+        knots = self._current_dense_solution().knots
+        knots = np.unique(np.concatenate([[start], knots[(knots > start) & (knots < end)], [end]]))
+
+        names = list(self.at(start, compartments))
+        nodes, weights = np.polynomial.legendre.leggauss(subdivisions)
+        nodes, weights = np.append(0, (nodes + 1) / 2), np.append(0, weights / 2)     # on [0, 1], plus the knot
+        cmax, tmax, auc = np.full(len(names), -np.inf), np.zeros(len(names)), np.zeros(len(names))
+        rows = np.arange(len(names))
+        step = max(chunk_size // (subdivisions + 1), 1)
+        for i in range(0, knots.size - 1, step):
+            bounds = knots[i:i + step + 1]
+            left, width = bounds[:-1], np.diff(bounds)
+            times = (left[:, None] + width[:, None] * nodes).ravel()
+            if i + step >= knots.size - 1:
+                times = np.append(times, end)
+            values = np.stack(list(self.at(times, names).values()))
+            best = values.argmax(axis=1)
+            better = values[rows, best] > cmax
+            cmax, tmax = np.where(better, values[rows, best], cmax), np.where(better, times[best], tmax)
+            auc += np.einsum('cki,k,i->c', values[:, :left.size * nodes.size].reshape(len(names), left.size, -1),
+                             width, weights)
+        return {name: {'cmax': float(cmax[j]), 'tmax': float(tmax[j]), 'auc': float(auc[j])}
+                for j, name in enumerate(names)}
+
+    def _parameter_derivatives(self, parameters):
+        # the derivatives of the rate matrix and of the initial amounts with respect to (compartment name, parameter) pairs
+        names = self.names
+        n = len(names)
+        volumes, rates_in, rates_out = self.volumes, self.rates_in, self.rates_out
+        dA, dy0 = np.zeros((len(parameters), n, n)), np.zeros((len(parameters), n))
+        for p, (name, parameter) in enumerate(parameters):
+            if names.count(name) != 1:
+                raise ValueError(f"There must be exactly one compartment named '{name}'.")
+            if parameter not in POPULATION_PARAMETERS:
+                raise ValueError(f"Unknown parameter '{parameter}'. Valid parameters are {list(POPULATION_PARAMETERS)}.")
+            j = names.index(name)
+            if parameter == 'initial_amount':
+                dy0[p, j] = 1.0
+            elif parameter == 'volume':
+                # column j of A is inversely proportional to the volume of compartment j,
+                # except for the absorption from the subcutaneous compartment
+                absorption = rates_out * (np.arange(n) != n - 1) if self.is_subcutaneous else rates_out
+                dA[p, :, j] = -assemble_rate_matrix(volumes, rates_in, absorption, self.is_subcutaneous,
+                                                    self.edges)[:, j] / volumes[j]
+            else:
+                # A is linear in the rates
+                unit = {'rate_in': np.zeros(n), 'rate_out': np.zeros(n)}
+                unit[parameter][j] = 1.0
+                dA[p] = assemble_rate_matrix(volumes, unit['rate_in'], unit['rate_out'], self.is_subcutaneous)
+        return dA, dy0
+
+    def sensitivities(self, parameters=None, method='analytic', rtol=1e-6, atol=1e-9, max_step=np.inf, times=None):
+        """
+        Solves the model over the same time grid as :meth:`solve`, together with the derivatives of the solution with
+        respect to compartment parameters (forward sensitivities), in a single pass rather than one solve per parameter.
+        For 'bolus' and 'continuous' dosing (with or without a dosing schedule), the derivatives of the closed-form
+        solution are evaluated (see :func:`propagate_sensitivities`); otherwise the sensitivity equations
+        dS/dt = A S + (dA/dp) y are integrated alongside the amounts y as one augmented system.
+        Nothing is written to the results/ directory.
+
+        :param parameters: The parameters, as (compartment name, parameter) pairs with parameter one of 'volume',
+            'rate_in', 'rate_out' and 'initial_amount'. Defaults to every volume and rate that the solution depends on.
+        :type parameters: list
+        :param method: 'analytic' (default; custom dosage functions fall back to 'RK45') or an integration method
+            (see :meth:`solve`). Implicit methods are supplied with the (sparse) Jacobian of the augmented system.
+        :type method: str
+        :param rtol: The relative tolerance of the integration. Default is 1e-6.
+        :type rtol: float
+        :param atol: The absolute tolerance of the integration. Default is 1e-9.
+        :type atol: float
+        :param max_step: The maximum step size of the integration. Default is np.inf (no limit).
+        :type max_step: float
+        :param times: The (sorted) times at which to evaluate the solution, within [0, time_span). Defaults to the
+            timesteps of :meth:`solve`.
+        :type times: array_like
+        :return: A dictionary containing the timeseries for each compartment (as returned by :meth:`solve`), and a
+            dictionary mapping each (compartment name, parameter) pair to the derivatives of the timeseries, of shape
+            (n_compartments, n_times) with compartments in the order of compartment_list.
+        :rtype: tuple
+        :raises ValueError: If a parameter is unknown, or its compartment name is not unique.
+        :raises ValueError: If the times are not sorted or not within [0, time_span).
+
+        :Usage Example:
+
+        >>> timeseries, sensitivities = model.sensitivities([('Liver', 'volume'), ('Bloodstream', 'rate_out')])
+        >>> sensitivities[('Liver', 'volume')][0]    # d(central amount)/d(liver volume) over time
+        """
+        if parameters is None:
+            parameters = [(name, parameter) for name in self.names for parameter in SENSITIVITY_PARAMETERS]
+            dA, _ = self._parameter_derivatives(parameters)
+            parameters = [pair for pair, derivative in zip(parameters, dA) if derivative.any()]
+        parameters = [tuple(pair) for pair in parameters]
+        dA, dy0 = self._parameter_derivatives(parameters)
+        n, P = len(self.names), len(parameters)
+        t_eval = np.arange(0, self.time_span, 1) if times is None else np.asarray(times, dtype=float)
+        if t_eval.size and (np.any(np.diff(t_eval) < 0) or t_eval[0] < 0 or t_eval[-1] >= self.time_span):
+            raise ValueError("The times must be sorted and within [0, time_span).")
+
+        if method == 'analytic' and self.dose_type in ('bolus', 'continuous'):
+            u0 = self._linear_dosing()
+            def segment_solver(start, end, state, u, times):
+                y, s = propagate_sensitivities(self.rate_matrix, u0 + u, state[:n], state[n:].reshape(P, n), dA,
+                                               times - start)
+                yield np.concatenate([y, s.reshape(P * n, y.shape[-1])])
+        else:
+            # one augmented ODE system for the amounts y and the sensitivities S, of Jacobian [[A, 0], [dA, I x A]]
+            method = 'RK45' if method == 'analytic' else method
+            method = self.select_method() if method == 'auto' else method
+            options = {'rtol': rtol, 'atol': atol, 'max_step': max_step}
+            if method in IMPLICIT_METHODS:
+                A = self.sparse_rate_matrix
+                jac = scipy.sparse.bmat([[A, None], [scipy.sparse.csr_matrix(dA.reshape(P * n, n)),
+                                                     scipy.sparse.kron(scipy.sparse.identity(P), A)]], format='csc')
+                jac = jac.toarray() if method == 'LSODA' else jac    # LSODA only accepts dense Jacobians
+                options['jac'] = lambda t, z: jac
+            def segment_solver(start, end, state, u, times):
+                def rhs(t, z):
+                    y, S = z[:n], z[n:].reshape(P, n)
+                    return np.concatenate([self.linear_ode_system(t, y) + u, (self._system_matrix @ S.T).T.ravel() + (dA @ y).ravel()])
+                yield from stream_ivp(rhs, [start, end], state, times, method=method, **options)
+
+        z0 = np.concatenate([self._initial_amounts(), dy0.ravel()])
+        windows = self._iterate_schedule(t_eval, z0, segment_solver, max(t_eval.size, 1))
+        z = np.concatenate([window for _, window in windows], axis=-1)
+        timeseries = dict(zip(self.names, z))
+        return timeseries, {pair: z[n * (p + 1):n * (p + 2)] for p, pair in enumerate(parameters)}
+
+    def fit(self, observations, free_params, **options):
+        """
+        Estimates compartment parameters from timed concentration samples, and leaves the model with the best
+        parameters found. See :func:`PKPy.fit.fit` for the observations, options and result.
+
+        :param observations: A dictionary mapping compartment names to (times, concentrations) pairs of arrays.
+        :type observations: dict
+        :param free_params: The parameters to estimate, as (compartment name, parameter) pairs.
+        :type free_params: list
+        :param options: Keyword arguments passed on to :func:`PKPy.fit.fit` (e.g. n_starts, bounds, max_workers).
+        :return: The best parameters, with the cost, timing and number of solves of every start.
+        :rtype: dict
+        """
+        from .fit import fit
+        return fit(self, observations, free_params, **options)
+
+    def solve_population(self, param_table, method='analytic', rtol=1e-3, atol=1e-6, max_step=np.inf):
+        """
+        Solves the model for a whole population of individuals at once, over the same time grid as :meth:`solve`.
+        All individuals share the model structure and dosing, but each may have its own compartment parameters.
+        The individuals are solved together, either as one batched closed-form solution ('analytic', for 'bolus' and
+        'continuous' dosing) or as one stacked ODE system. Nothing is written to the results/ directory.
+
+        :param param_table: A dictionary mapping any of 'volume', 'rate_in', 'rate_out' and 'initial_amount' to an
+            array of shape (n_individuals, n_compartments), with compartments in the order of compartment_list.
+            Parameters that are not given are taken from the model for every individual.
+        :type param_table: dict
+        :param method: 'analytic' (default; custom dosage functions fall back to 'RK45') or an integration method
+            for scipy.integrate.solve_ivp. Implicit methods are supplied with the block-diagonal Jacobian.
+            Use 'auto' to select 'BDF' if any individual is stiff and 'RK45' otherwise.
+        :type method: str
+        :param rtol: The relative tolerance of the integration. Default is 1e-3.
+        :type rtol: float
+        :param atol: The absolute tolerance of the integration. Default is 1e-6.
+        :type atol: float
+        :param max_step: The maximum step size of the integration. Default is np.inf (no limit).
+        :type max_step: float
+        :return: The amounts of substance, of shape (n_individuals, n_compartments, n_timesteps).
+        :rtype: numpy.ndarray
+        :raises ValueError: If param_table contains unknown parameters or arrays of inconsistent shapes.
+        """
+        unknown = set(param_table) - set(POPULATION_PARAMETERS)
+        if unknown:
+            raise ValueError(f"Unknown population parameters: {sorted(unknown)}. "
+                             f"Valid parameters are {list(POPULATION_PARAMETERS)}.")
+        n = len(self.names)
+        try:
+            shape = np.broadcast_shapes(*[np.shape(value) for value in param_table.values()])
+        except ValueError:
+            raise ValueError("All population parameter arrays must have the same shape.")
+        if len(shape) != 2 or shape[1] != n:
+            raise ValueError(f"Population parameters must have shape (n_individuals, {n}).")
+        params = {key: np.broadcast_to(np.asarray(param_table.get(key, default), dtype=float), shape)
+                  for key, default in self.parameter_table().items()}
+
+        A = assemble_rate_matrix(params['volume'], params['rate_in'], params['rate_out'], self.is_subcutaneous,
+                                 self.edges)
+        y0 = params['initial_amount']
+        t_eval = np.arange(0, self.time_span, 1)
+
+        if method == 'analytic' and self.dose_type in ('bolus', 'continuous'):
+            u0 = self._linear_dosing()
+            def segment_solver(start, end, state, u, times):
+                yield propagate(A, u0 + u, state, times - start)
+        else:
+            # one stacked ODE system over all individuals
+            method = 'RK45' if method == 'analytic' else method
+            if method == 'auto':
+                method = 'BDF' if stiffness_ratio(A, self.time_span) > STIFFNESS_THRESHOLD else 'RK45'
+            options = {'rtol': rtol, 'atol': atol, 'max_step': max_step}
+            if method in IMPLICIT_METHODS:
+                jac = scipy.sparse.block_diag(A, format='csc')
+                jac = jac.toarray() if method == 'LSODA' else jac    # LSODA only accepts dense Jacobians
+                options['jac'] = lambda t, y: jac
+            def segment_solver(start, end, state, u, times):
+                rhs = lambda t, y: (np.einsum('kij,kj->ki', A, y.reshape(shape)) + self.dose_vector * self.dose(t) + u).ravel()
+                for states in stream_ivp(rhs, [start, end], state.ravel(), times, method=method, **options):
+                    yield states.reshape(shape + (-1,))
+
+        windows = self._iterate_schedule(t_eval, y0, segment_solver, max(t_eval.size, 1))
+        return np.concatenate([window for _, window in windows], axis=-1)
+
     @staticmethod
     def random_color_generator():
         color = np.random.randint(0, 256, size=3)
         return tuple(color/255)
         
-    def plot(self, title='PK Model', zoom_start=0, zoom_end=100, output='pk_model.png'):       
+    def plot(self, title='PK Model', zoom_start=0, zoom_end=100, output='pk_model.png', dpi=300, decimate=True):
         """
         Plots the ODE solutions over time. Requires Model.solve() to be run first.
+        The plot is rendered off-screen; if the solution is no longer in memory, it is memory-mapped from the
+        results file, so that only the zoomed-in window is read in full.
 
         :param title: Title of the plot. Default is 'PK Model'.
         :type title: str
@@ -191,7 +1306,12 @@ class Model():
         :type zoom_end: int
         :param output: Output file name for the plot. Default is 'pk_model.png'.
         :type output: str
-        :raises ValueError: If no timeseries data is found, or if the pickle file is not a dictionary.
+        :param dpi: Resolution of the plot in dots per inch. Default is 300.
+        :type dpi: int
+        :param decimate: Whether to reduce each timeseries to its minimum and maximum per pixel before plotting
+            (see :func:`decimate_minmax`), which looks the same but renders much faster for long timeseries. Default is True.
+        :type decimate: bool
+        :raises ValueError: If no timeseries data is found, or if the results file is a pickle file that is not a dictionary.
 
         :Usage Example:
 
@@ -199,71 +1319,70 @@ class Model():
         >>> model.solve()
         >>> model.plot()   # outputs a plot of the model to results/
         """
-        
+
+        # plotting dependencies are imported on first use, so that importing PKPy does not load matplotlib
+        import matplotlib
+        import matplotlib.figure
+        from mpl_toolkits.axes_grid1 import make_axes_locatable
+
         if hasattr(self, 'timeseries'):
             data = self.timeseries
-        elif os.path.exists(f'results/timeseries_{self.initiation_time}.pickle'):
-            with open(f'results/timeseries_{self.initiation_time}.pickle', 'rb') as handle:
-                data = pickle.load(handle)
-                if type(data) != dict:
-                    raise ValueError(f"Pickle file 'results/timeseries_{self.initiation_time}.pickle' is not a dictionary.")
-        else:   
+        elif os.path.exists(getattr(self, 'results_path', '')):
+            data = load_timeseries(self.results_path)
+        else:
             raise ValueError("No timeseries data found. Please run solve() first.")
-        
-        plt.rcParams["font.family"] = "serif"
-        plt.rcParams["mathtext.fontset"] = "dejavuserif"
 
-        ## DATA
-        # Get the compartments from the data
-        compartments = list(data.keys())
+        with matplotlib.rc_context({"font.family": "serif", "mathtext.fontset": "dejavuserif"}):
 
-        ## COlOURS
-        colors_p = ["#091326","#84AEBF","#F29966","#BF5D39","#59211C"]
-        colors_gen = [self.random_color_generator() for i in range(len(compartments))]
-        colors = colors_p + colors_gen
+            ## DATA
+            # Get the compartments from the data
+            compartments = list(data.keys())
 
+            ## COlOURS
+            colors_p = ["#091326","#84AEBF","#F29966","#BF5D39","#59211C"]
+            colors_gen = [self.random_color_generator() for i in range(len(compartments))]
+            colors = colors_p + colors_gen
 
-        ## FIGURE
-        # Create figure
-        fig, ax = plt.subplots(dpi=300, figsize=(9, 3.5))
+            ## FIGURE
+            # Create figure (without pyplot, so that nothing is kept open after saving)
+            fig = matplotlib.figure.Figure(dpi=dpi, figsize=(9, 3.5))
+            ax = fig.subplots()
+            n_buckets = int(fig.get_figwidth() * dpi)   # at most one bucket per pixel
 
-        # Plot the full data on the main axis
-        for i, j in enumerate(compartments):
-            ax.plot(data[j], label=j, c=colors[i])
+            # Plot the full data on the main axis
+            for i, j in enumerate(compartments):
+                x, y = decimate_minmax(data[j], n_buckets) if decimate else (np.arange(len(data[j])), data[j])
+                ax.plot(x, y, label=j, c=colors[i])
 
-        # Title 
-        fig.suptitle(title, fontsize="large", y=1.05)
+            # Title
+            fig.suptitle(title, fontsize="large", y=1.05)
 
-        ## MAIN AXIS TICKS
-        # Set y-axis ticks on the right side of the plot
-        ax.yaxis.tick_right()
-        
-        # Turn off y tick labels and yaxis on axm (main axis/plot)
-        # axm = ax.axes.get_yaxis()
-        # axm.set_visible(False)
-        # axm.set_minor_locator(plt.NullLocator())
-
-        ## LEFT ZOOMED AXIS
-        # Create new axes on the left of the current axes
-        divider = make_axes_locatable(ax)
-        ax_zm = divider.append_axes("left", 2, pad=0.2)
-        ax_zm.set_title('Zoomed in', fontsize="medium")
-        ax_zm.set_ylim(-25, 50*self.dose_constant)
-        ax.set_title('Full Plot', fontsize="medium")
-
-        # Plot the zoomed in data on the left axis
-        for i, j in enumerate(compartments):
-            ax_zm.plot(data[j][zoom_start:zoom_end], label=j, c=colors[i])
-
-        ## LABELS
-        # Show y-labels on ax_zm (zoomed axis)
-        ax_zm.set_ylabel('Concentration (mg/L)', fontsize="medium")
-        ax_zm.set_xlabel('Timestep', fontsize="medium")
-        ax.set_xlabel('Timestep', fontsize="medium")
-
-        # Show legend
-        ax.legend(loc='upper left', fontsize="x-small", frameon=False) # full plot # 
-
-
-        # Save the figure
-        plt.savefig(output, dpi=300, bbox_inches='tight')
+            ## MAIN AXIS TICKS
+            # Set y-axis ticks on the right side of the plot
+            ax.yaxis.tick_right()
+
+            ## LEFT ZOOMED AXIS
+            # Create new axes on the left of the current axes
+            divider = make_axes_locatable(ax)
+            ax_zm = divider.append_axes("left", 2, pad=0.2)
+            ax_zm.set_title('Zoomed in', fontsize="medium")
+            ax_zm.set_ylim(-25, 50*max([self.dose_constant] + [event['amount'] for event in self.dosing_schedule]))
+            ax.set_title('Full Plot', fontsize="medium")
+
+            # Plot the zoomed in data on the left axis
+            for i, j in enumerate(compartments):
+                window = data[j][zoom_start:zoom_end]
+                x, y = decimate_minmax(window, n_buckets) if decimate else (np.arange(len(window)), window)
+                ax_zm.plot(zoom_start + x, y, label=j, c=colors[i])
+
+            ## LABELS
+            # Show y-labels on ax_zm (zoomed axis)
+            ax_zm.set_ylabel('Concentration (mg/L)', fontsize="medium")
+            ax_zm.set_xlabel('Timestep', fontsize="medium")
+            ax.set_xlabel('Timestep', fontsize="medium")
+
+            # Show legend
+            ax.legend(loc='upper left', fontsize="x-small", frameon=False) # full plot #
+
+            # Save the figure
+            fig.savefig(output, dpi=dpi, bbox_inches='tight')
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def decimate_minmax(series, n_buckets):
+    """
+    Downsamples a timeseries for plotting by splitting it into buckets (e.g. one per pixel) and keeping only the
+    minimum and maximum of each bucket, in time order. Peaks and troughs are therefore preserved exactly.
+    The series is only read, never copied as a whole, so it may be a memory-mapped array.
+
+    :param series: The timeseries.
+    :type series: numpy.ndarray
+    :param n_buckets: The number of buckets.
+    :type n_buckets: int
+    :return: The indices of the kept samples and their values.
+    :rtype: tuple
+    """
+    n = len(series)
+    if n <= 2 * n_buckets:
+        return np.arange(n), np.asarray(series)
+    size = n // n_buckets
+    buckets = np.asarray(series[:n_buckets * size]).reshape(n_buckets, size)
+    offsets = np.arange(n_buckets)[:, None] * size
+    indices = np.sort(np.stack([buckets.argmin(axis=1), buckets.argmax(axis=1)], axis=1) + offsets, axis=1).ravel()
+    if n_buckets * size < n:      # the remainder forms one more bucket
+        tail = np.asarray(series[n_buckets * size:])
+        indices = np.append(indices, np.sort([tail.argmin(), tail.argmax()]) + n_buckets * size)
+    indices = np.unique(np.concatenate([[0], indices, [n - 1]]))
+    return indices, np.asarray(series[indices])
+
+
+def plot_models(models, outputs, **plot_options):
+    """
+    Renders the plots of many (solved) models in one go, off-screen. See :meth:`Model.plot` for the plot options.
+
+    :param models: The models to plot.
+    :type models: list
+    :param outputs: The output file names, one per model.
+    :type outputs: list
+    :param plot_options: Keyword arguments passed on to :meth:`Model.plot` (e.g. dpi).
+    :return: The output file names.
+    :rtype: list
+    :raises ValueError: If there is not exactly one output file name per model.
+    """
+    if len(models) != len(outputs):
+        raise ValueError("There must be exactly one output file name per model.")
+    for model, output in zip(models, outputs):
+        model.plot(output=output, **plot_options)
+    return list(outputs)
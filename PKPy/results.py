@@ -0,0 +1,199 @@
+import os
+import json
+import uuid
+import datetime
+import numpy as np
+
+MAGIC = b'PKPYRES1'     # file signature, followed by the header length (8 bytes, little-endian) and the JSON header
+ALIGNMENT = 64          # the data block starts at a multiple of this many bytes
+DTYPE = '<f8'
+
+
+def unique_results_path(directory='results', prefix='timeseries'):
+    """
+    Returns a new, collision-free path for a results file, safe to use from concurrent runs and processes.
+
+    :param directory: The directory of the results file. Default is 'results'.
+    :type directory: str
+    :param prefix: The prefix of the file name. Default is 'timeseries'.
+    :type prefix: str
+    :return: The path, of the form <directory>/<prefix>_<timestamp>_<process id>_<random hex>.pkpy.
+    :rtype: str
+    """
+    timestamp = datetime.datetime.now().strftime("%Y_%m_%d-%H_%M_%S_%f")
+    return os.path.join(directory, f'{prefix}_{timestamp}_{os.getpid()}_{uuid.uuid4().hex[:8]}.pkpy')
+
+
+class ResultsWriter:
+    """
+    This class writes the timeseries of a model run into a columnar results file: a small JSON header (with the
+    model hash, the time grid and the compartment names) followed by one contiguous float64 array per compartment,
+    which can be memory-mapped by :class:`ResultsReader`. The file is written under a temporary name and only
+    appears under its final path once it is complete (see :meth:`close`).
+
+    :param path: The path of the results file.
+    :type path: str
+    :param compartments: The names of the compartments, in the order of the rows of the data.
+    :type compartments: list
+    :param n_times: The number of timesteps.
+    :type n_times: int
+    :param start: The first time of the (evenly spaced) time grid. Default is 0.
+    :type start: float
+    :param step: The spacing of the time grid. Default is 1.
+    :type step: float
+    :param model_hash: A hash identifying the model configuration. Default is ''.
+    :type model_hash: str
+
+    :Usage Example:
+
+    >>> with ResultsWriter('results/run.pkpy', ['Central', 'Liver'], 1000) as writer:
+    ...     writer.write(0, window)     # window of shape (2, k), for timesteps 0 to k-1
+    """
+    def __init__(self, path, compartments, n_times, start=0, step=1, model_hash=''):
+        self.path = path
+        header = json.dumps({'version': 1, 'model_hash': model_hash, 'compartments': list(compartments),
+                             'time': {'start': start, 'step': step, 'n': int(n_times)}, 'dtype': DTYPE}).encode()
+        offset = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+        header = header.ljust(offset - len(MAGIC) - 8)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        with open(self._tmp_path, 'wb') as f:
+            f.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+        shape = (len(compartments), int(n_times))
+        self.data = np.memmap(self._tmp_path, dtype=DTYPE, mode='r+', offset=offset, shape=shape) if n_times else None
+
+    def write(self, start, window):
+        """
+        Writes a window of the timeseries.
+
+        :param start: The index of the first timestep of the window.
+        :type start: int
+        :param window: The amounts in each compartment, of shape (n_compartments, k).
+        :type window: numpy.ndarray
+        """
+        self.data[:, start:start + window.shape[-1]] = window
+
+    def close(self):
+        """
+        Flushes the data to disk and moves the complete file to its final path.
+        """
+        if self.data is not None:
+            self.data.flush()
+            self.data = None    # releases the memory map
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.data = None
+            os.remove(self._tmp_path)
+
+
+class ResultsReader:
+    """
+    This class gives zero-copy access to a results file written by :class:`ResultsWriter`, by memory-mapping it.
+    Single compartments and time windows are read as views, without loading the rest of the file.
+
+    :param path: The path of the results file.
+    :type path: str
+
+    :ivar str model_hash: The hash identifying the model configuration.
+    :ivar list compartments: The names of the compartments.
+    :ivar float start: The first time of the time grid.
+    :ivar float step: The spacing of the time grid.
+    :ivar numpy.memmap data: The memory-mapped data, of shape (n_compartments, n_times).
+
+    :Usage Example:
+
+    >>> results = ResultsReader('results/run.pkpy')
+    >>> results['Central']                  # timeseries of one compartment
+    >>> results.window(100, 200, ['Liver'])  # shape (1, 100)
+    """
+    def __init__(self, path):
+        """
+        Initializes a ResultsReader object for the given results file.
+
+        :param path: The path of the results file.
+        :type path: str
+        :raises ValueError: If the file is not a results file.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"File '{path}' is not a PKPy results file.")
+            length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(length))
+        self.model_hash = header['model_hash']
+        self.compartments = header['compartments']
+        time = header['time']
+        self.start, self.step = time['start'], time['step']
+        shape = (len(self.compartments), time['n'])
+        offset = len(MAGIC) + 8 + length
+        self.data = np.memmap(path, dtype=header['dtype'], mode='r', offset=offset, shape=shape) if time['n'] \
+            else np.empty(shape)
+
+    @property
+    def times(self):
+        """
+        The time grid of the results.
+
+        :rtype: numpy.ndarray
+        """
+        return self.start + self.step * np.arange(self.data.shape[1])
+
+    def _index(self, time):
+        # index of the first timestep at or after the given time
+        return int(np.clip(np.ceil((time - self.start) / self.step), 0, self.data.shape[1]))
+
+    def __getitem__(self, name):
+        """
+        Returns the timeseries of the compartment with the given name (as a memory-mapped view).
+
+        :param name: The name of the compartment.
+        :type name: str
+        :return: The timeseries.
+        :rtype: numpy.memmap
+        :raises KeyError: If there is no compartment of that name.
+        """
+        if name not in self.compartments:
+            raise KeyError(name)
+        return self.data[self.compartments.index(name)]
+
+    def window(self, start_time=None, end_time=None, compartments=None):
+        """
+        Returns the timeseries within a time window, for all or some of the compartments.
+
+        :param start_time: The first time of the window (inclusive). Defaults to the start of the time grid.
+        :type start_time: float
+        :param end_time: The last time of the window (exclusive). Defaults to the end of the time grid.
+        :type end_time: float
+        :param compartments: The names of the compartments. Defaults to all compartments.
+        :type compartments: list
+        :return: The amounts, of shape (n_compartments, n_times_in_window); a memory-mapped view if
+            all compartments or a single one are requested.
+        :rtype: numpy.ndarray
+        """
+        first = 0 if start_time is None else self._index(start_time)
+        last = self.data.shape[1] if end_time is None else self._index(end_time)
+        if compartments is None:
+            return self.data[:, first:last]
+        rows = [self.compartments.index(name) for name in compartments]
+        if len(rows) == 1:
+            return self.data[rows[0]:rows[0] + 1, first:last]
+        return self.data[rows, first:last]
+
+    def to_dict(self):
+        """
+        Returns the timeseries of all compartments (as memory-mapped views).
+
+        :return: A dictionary containing the timeseries for each compartment, as returned by :meth:`Model.solve`.
+        :rtype: dict
+        """
+        return {name: self.data[i] for i, name in enumerate(self.compartments)}
@@ -0,0 +1,228 @@
+"""
+A long-lived solver service, which solves model configurations received as dictionaries without touching the
+filesystem, batching concurrent requests of the same model structure into one vectorized population solve.
+
+Run from the command line as a stdin/stdout stand-in for a network service, e.g.
+
+    python -m PKPy.service < requests.jsonl > responses.jsonl
+
+with one JSON request {"id": ..., "config": {...}} per line (config in the layout of the JSON config file), and one
+JSON response {"id": ..., "timeseries": {compartment: [...]}} or {"id": ..., "error": "..."} per line, in the order
+in which the requests are solved.
+"""
+import sys
+import json
+import asyncio
+import argparse
+import numpy as np
+
+from .model import Model, POPULATION_PARAMETERS
+
+
+def structure_key(basic_params, compartments):
+    """
+    Returns a key that is equal for two system configurations (as returned by :meth:`Parser.construct`) if and only
+    if they differ at most in their compartment parameters, so that they can be solved together as a population
+    (see :meth:`Model.solve_population`).
+
+    :param basic_params: The model's basic parameters.
+    :type basic_params: dict
+    :param compartments: The individual compartment parameters.
+    :type compartments: list
+    :return: The key.
+    :rtype: str
+    """
+    structure = [{key: value for key, value in compartment.items() if key not in POPULATION_PARAMETERS}
+                 for compartment in compartments]
+    return json.dumps([basic_params, structure], sort_keys=True)
+
+
+class SolverService:
+    """
+    This class solves model configurations asynchronously. Requests are queued, and a single worker takes all
+    queued requests at once (after waiting batch_delay for more to arrive), groups them by model structure (see
+    :func:`structure_key`), and solves each group as one population (see :meth:`Model.solve_population`) in a
+    thread, so that the event loop stays responsive. Requests that arrive during a solve are batched into the next
+    one. The queue holds at most max_pending requests, beyond which :meth:`submit` waits (backpressure).
+
+    :param method: The method of :meth:`Model.solve_population`. Default is 'analytic'.
+    :type method: str
+    :param max_batch: The maximum number of requests solved together. Default is 256.
+    :type max_batch: int
+    :param max_pending: The maximum number of queued requests. Default is 1024.
+    :type max_pending: int
+    :param batch_delay: The time (in seconds) to wait for more requests before solving. Default is 0.002.
+    :type batch_delay: float
+    :param solve_options: Keyword arguments passed on to :meth:`Model.solve_population` (e.g. rtol, atol).
+    :raises ValueError: If max_batch or max_pending is not positive.
+
+    :Usage Example:
+
+    >>> async with SolverService() as service:
+    ...     results = await asyncio.gather(*[service.solve(config) for config in configs])
+    >>> results[0]['Bloodstream']     # amounts of substance, one per timestep
+    """
+    def __init__(self, method='analytic', max_batch=256, max_pending=1024, batch_delay=0.002, **solve_options):
+        if max_batch < 1 or max_pending < 1:
+            raise ValueError("The maximum batch size and number of pending requests must be positive.")
+        self.method, self.solve_options = method, solve_options
+        self.max_batch, self.max_pending, self.batch_delay = max_batch, max_pending, batch_delay
+        self.stats = {'requests': 0, 'batches': 0, 'solves': 0, 'largest_batch': 0}
+        self._queue = None
+        self._worker = None
+
+    async def start(self):
+        """
+        Starts the worker on the running event loop.
+        """
+        if self._worker is None:
+            self._queue = asyncio.Queue(self.max_pending)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Waits until all queued requests are solved, and stops the worker.
+        """
+        if self._worker is not None:
+            await self._queue.join()
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def submit(self, config):
+        """
+        Validates a system configuration and queues it, waiting while the queue is full.
+
+        :param config: The system configuration, in the layout of the JSON config file.
+        :type config: dict
+        :return: A future of the solution, a dictionary containing the amounts of substance (one per timestep) for
+            each compartment.
+        :rtype: asyncio.Future
+        :raises ValueError: If the configuration is invalid (see :meth:`Parser.construct`).
+        """
+        await self.start()
+        model = Model(config)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((structure_key(*model.config), model, future))
+        self.stats['requests'] += 1
+        return future
+
+    async def solve(self, config):
+        """
+        Solves a system configuration, together with any concurrent requests of the same structure.
+
+        :param config: The system configuration, in the layout of the JSON config file.
+        :type config: dict
+        :return: A dictionary containing the amounts of substance (one per timestep) for each compartment.
+        :rtype: dict
+        :raises ValueError: If the configuration is invalid (see :meth:`Parser.construct`).
+        """
+        return await (await self.submit(config))
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                groups = {}
+                for key, model, future in batch:
+                    groups.setdefault(key, []).append((model, future))
+                for group in groups.values():
+                    await self._solve_group(group)
+                self.stats['batches'] += 1
+                self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+            except Exception as error:
+                # e.g. while grouping; fail the requests of this batch rather than the worker, which serves the next
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _solve_group(self, group):
+        models = [model for model, _ in group]
+        tables = [model.parameter_table() for model in models]
+        param_table = {key: np.stack([table[key] for table in tables]) for key in POPULATION_PARAMETERS}
+        try:
+            amounts = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: models[0].solve_population(param_table, method=self.method, **self.solve_options))
+            self.stats['solves'] += 1
+        except Exception as error:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (model, future), individual in zip(group, amounts):
+            if not future.done():   # e.g. cancelled by the client
+                future.set_result(dict(zip(model.names, individual)))
+
+
+async def serve(reader, writer, service):
+    """
+    Serves JSON-lines requests {"id": ..., "config": {...}} from a stream until it ends, writing one JSON-lines
+    response {"id": ..., "timeseries": {...}} or {"id": ..., "error": "..."} per request as soon as it is solved.
+    Reading pauses while the service queue is full.
+
+    :param reader: An async callable returning the next line (empty at the end of the stream).
+    :type reader: callable
+    :param writer: A callable writing a line.
+    :type writer: callable
+    :param service: The service.
+    :type service: SolverService
+    """
+    async def respond(request_id, future):
+        try:
+            timeseries = await future
+            response = {'id': request_id, 'timeseries': {name: values.tolist() for name, values in timeseries.items()}}
+        except Exception as error:
+            response = {'id': request_id, 'error': str(error)}
+        writer(json.dumps(response) + '\n')
+
+    responses = []
+    async with service:
+        while line := await reader():
+            if not line.strip():
+                continue
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get('id')
+                future = await service.submit(request['config'])
+            except Exception as error:
+                future = asyncio.get_running_loop().create_future()
+                future.set_exception(ValueError(f"Invalid request: {error!r}"))
+            responses.append(asyncio.create_task(respond(request_id, future)))
+        await asyncio.gather(*responses)
+
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    arguments.add_argument('--method', default='analytic')
+    arguments.add_argument('--max-batch', type=int, default=256)
+    arguments.add_argument('--max-pending', type=int, default=1024)
+    args = arguments.parse_args(argv)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        reader = lambda: loop.run_in_executor(None, sys.stdin.readline)
+        def writer(line):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        await serve(reader, writer, SolverService(args.method, args.max_batch, args.max_pending))
+
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import copy
+import heapq
+import concurrent.futures
+
+from .system_parser import Parser
+from .model import Model, PARAMETER_ARRAYS
+
+_base_config = None     # (basic_params, compartments) of the swept model, set once per worker process
+_base_model = None      # the swept model, built once per worker process
+
+
+def _init_worker(basic_params, compartments):
+    global _base_config, _base_model
+    _base_config = (basic_params, compartments)
+    _base_model = Model.from_config(basic_params, compartments)
+
+
+def apply_overrides(basic_params, compartments, overrides):
+    """
+    Returns copies of a constructed system configuration with some of its parameters replaced, validated and
+    completed with defaults (e.g. of the dosing events) as by :meth:`Parser.construct`.
+
+    :param basic_params: The model's basic parameters (as returned by :meth:`Parser.construct`).
+    :type basic_params: dict
+    :param compartments: The individual compartment parameters (as returned by :meth:`Parser.construct`).
+    :type compartments: list
+    :param overrides: A dictionary in the layout of the system config file: the key 'basic_parameters' maps to
+        replacement basic parameters, and compartment names map to replacement compartment parameters
+        (applied to all compartments of that name), e.g. {'liver': {'volume': 250}}.
+    :type overrides: dict
+    :return: A list, containing the updated basic parameters and compartment parameters.
+    :rtype: list
+    :raises ValueError: If an override refers to a compartment that does not exist.
+    :raises ValueError: If the updated configuration is invalid (see :meth:`Parser.construct`).
+    """
+    basic_params, compartments = copy.deepcopy(basic_params), copy.deepcopy(compartments)
+    names = {compartment['name'] for compartment in compartments}
+    for key, values in overrides.items():
+        if key == 'basic_parameters':
+            basic_params.update(values)
+        elif key in names:
+            for compartment in compartments:
+                if compartment['name'] == key:
+                    compartment.update(values)
+        else:
+            raise ValueError(f"There is no compartment named {key} in the model.")
+    config = {'basic_parameters': basic_params}
+    config.update({f'compartment_{i}': compartment for i, compartment in enumerate(compartments, 1)})
+    return Parser(config).construct()
+
+
+def _override_model(overrides):
+    # overrides of the parameters of uniquely named compartments only change the parameter arrays of a copy of
+    # the base model; any other overrides (e.g. of basic parameters) rebuild the model from its configuration
+    if all(name in _base_model.names and _base_model.names.count(name) == 1 and set(values) <= set(PARAMETER_ARRAYS)
+           for name, values in overrides.items()):
+        model = _base_model.copy()
+        model.set_parameters({(name, parameter): value for name, values in overrides.items()
+                              for parameter, value in values.items()})
+        return model
+    return Model.from_config(*apply_overrides(*_base_config, overrides))
+
+
+def _solve_chunk(chunk, solve_options):
+    results = []
+    for index, overrides in chunk:
+        results.append((index, _override_model(overrides).solve(save=False, **solve_options)))
+    return results
+
+
+class ParameterSweep:
+    """
+    This class solves a model for many parameter sets in parallel, on a pool of worker processes.
+    The system file is parsed once; each worker receives the constructed configuration once,
+    and afterwards only the (small) parameter overrides for every solve.
+
+    :param systemfile: The path to the system file of the model to sweep.
+    :type systemfile: str
+    :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+    :type max_workers: int
+    :param chunk_size: The number of parameter sets sent to a worker at a time. Default is 1.
+    :type chunk_size: int
+
+    :Usage Example:
+
+    >>> sweep = ParameterSweep('system.json', chunk_size=10)
+    >>> param_sets = [{'Liver': {'volume': v}} for v in range(100, 1000, 10)]
+    >>> for index, timeseries in sweep.run(param_sets):
+    ...     print(index, timeseries['Liver'].max())
+    """
+    def __init__(self, systemfile, max_workers=None, chunk_size=1):
+        """
+        Initializes a ParameterSweep object for the model in the given system file.
+
+        :param systemfile: The path to the system file.
+        :type systemfile: str
+        :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+        :type max_workers: int
+        :param chunk_size: The number of parameter sets sent to a worker at a time. Default is 1.
+        :type chunk_size: int
+        :raises ValueError: If chunk_size is not a positive integer.
+        """
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise ValueError("The chunk size must be a positive integer.")
+        self.basic_params, self.compartments = Parser(systemfile).construct()
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def run(self, param_sets, ordered=False, **solve_options):
+        """
+        Solves the model for every parameter set and yields the solutions as they become available.
+
+        :param param_sets: The parameter overrides for each solve (see :func:`apply_overrides`).
+        :type param_sets: iterable
+        :param ordered: Whether to yield the solutions in the order of param_sets (True),
+            or in order of completion (False, default).
+        :type ordered: bool
+        :param solve_options: Keyword arguments passed on to :meth:`Model.solve`, except save (nothing is saved to disk).
+        :return: A generator of (index, timeseries) tuples, where index is the position of the parameter set in
+            param_sets and timeseries is the dictionary returned by :meth:`Model.solve`.
+        :rtype: generator
+        :raises ValueError: If the solve options contain save.
+        :raises ValueError: If a parameter set is invalid (see :func:`apply_overrides`). Each chunk of parameter sets
+            is validated just before it is submitted, so the solutions of earlier chunks may have been yielded already.
+        """
+        if 'save' in solve_options:
+            raise ValueError("The solutions of a sweep are never saved to disk; 'save' cannot be passed.")
+        tasks = list(enumerate(param_sets))
+        chunks = iter([tasks[i:i + self.chunk_size] for i in range(0, len(tasks), self.chunk_size)])
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                                    initargs=(self.basic_params, self.compartments)) as executor:
+            running, pending, next_index = set(), [], 0
+            while True:
+                # submit the next chunk (once validated), and collect whatever has completed meanwhile
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    for index, overrides in chunk:
+                        try:
+                            apply_overrides(self.basic_params, self.compartments, overrides)
+                        except ValueError as error:
+                            raise ValueError(f"Parameter set {index} is invalid: {error}")
+                    running.add(executor.submit(_solve_chunk, chunk, solve_options))
+                if not running:
+                    break
+                done, running = concurrent.futures.wait(running, timeout=0 if chunk is not None else None,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if not ordered:
+                        yield from future.result()
+                        continue
+                    # buffer until all preceding results are in
+                    for result in future.result():
+                        heapq.heappush(pending, result)
+                    while pending and pending[0][0] == next_index:
+                        yield heapq.heappop(pending)
+                        next_index += 1
+
+    def run_all(self, param_sets, **solve_options):
+        """
+        Solves the model for every parameter set and returns all solutions in the order of param_sets.
+
+        :param param_sets: The parameter overrides for each solve (see :func:`apply_overrides`).
+        :type param_sets: iterable
+        :param solve_options: Keyword arguments passed on to :meth:`Model.solve`.
+        :return: A list of dictionaries as returned by :meth:`Model.solve`.
+        :rtype: list
+        """
+        return [timeseries for _, timeseries in self.run(param_sets, ordered=True, **solve_options)]
@@ -1,13 +1,65 @@
+import ast
+import copy
 import json
+import functools
 import numpy as np
 
+DOSE_NUMPY_NAMES = {'pi', 'e', 'inf', 'where', 'clip'}     # allowed non-ufunc numpy names in dose expressions
+DOSE_AST_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.keyword, ast.Attribute,
+                  ast.Name, ast.Constant, ast.Load, ast.operator, ast.unaryop, ast.cmpop)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_dose_expression(expression):
+    """
+    Compiles a user-provided dosage function, given as an expression of time 'x' (e.g. 'np.cos(x + 3)'), into a
+    callable. The expression is parsed and compiled only once (the 1024 most recently used expressions are cached);
+    it may only contain numbers, 'x', arithmetic and comparison operators, and numpy ufuncs or constants. The
+    resulting function accepts a scalar time as well as an array of times.
+
+    :param expression: The dosage function expression.
+    :type expression: str
+    :return: The dosage function.
+    :rtype: callable
+    :raises ValueError: If the expression is not a valid dosage function expression.
+    """
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        raise ValueError(f"The dosage function '{expression}' is not a valid expression.")
+    for node in ast.walk(tree):
+        if not isinstance(node, DOSE_AST_NODES) or isinstance(node, ast.Constant) and type(node.value) not in [int, float]:
+            raise ValueError(f"The dosage function '{expression}' contains an unsupported element "
+                             f"'{ast.unparse(node) if isinstance(node, ast.expr) else type(node).__name__}'.")
+        if isinstance(node, ast.Name) and node.id not in ['x', 'np']:
+            raise ValueError(f"The dosage function '{expression}' may only depend on 'x', not '{node.id}'.")
+        if isinstance(node, ast.Attribute) and not (isinstance(node.value, ast.Name) and node.value.id == 'np' and (
+                isinstance(getattr(np, node.attr, None), np.ufunc) or node.attr in DOSE_NUMPY_NAMES)):
+            raise ValueError(f"The dosage function '{expression}' may only use numpy ufuncs and constants, "
+                             f"not '{ast.unparse(node)}'.")
+
+    code = compile(tree, '<dose>', 'eval')
+    namespace = {'np': np, '__builtins__': {}}
+
+    def dosage_function(x):
+        value = eval(code, namespace, {'x': x})
+        return value if np.ndim(x) == 0 else np.broadcast_to(value, np.shape(x))
+
+    try:
+        dosage_function(10)
+        dosage_function(np.arange(2.0))
+    except Exception as error:
+        raise ValueError(f"The dosage function '{expression}' cannot be evaluated: {error}")
+    return dosage_function
+
 
 class Parser:
     """
-    This class parses and stores the system configuration from a user-provided config file in JSON (compartment definitions).
+    This class parses and stores the system configuration from a user-provided config file in JSON (compartment definitions),
+    or from a dictionary in the same layout (e.g. received by a service, see :mod:`PKPy.service`).
 
-    :param system_config: The path to the system configuration file (compartment definitions).
-    :type system_config: str
+    :param system_config: The path to the system configuration file (compartment definitions), or the configuration itself.
+    :type system_config: str or dict
 
     :Usage Example:
 
@@ -19,14 +71,18 @@ class Parser:
     def __init__(self, system_config):
         """
         Initializes a Parser object with the given system configuration file (model compartment definitions).
+        A configuration dictionary is copied, so that it is never modified by :meth:`construct`.
 
-        :param system_config: The path to the system configuration file.
-        :type system_config: str
+        :param system_config: The path to the system configuration file, or the configuration dictionary.
+        :type system_config: str or dict
 
         :rtype: None 
         """
-        with open(system_config) as system_config_file:
-            self.sys_config = json.load(system_config_file)
+        if isinstance(system_config, dict):
+            self.sys_config = copy.deepcopy(system_config)
+        else:
+            with open(system_config) as system_config_file:
+                self.sys_config = json.load(system_config_file)
 
     def construct(self):
         """
@@ -37,11 +93,13 @@ class Parser:
 
         :raises ValueError: If the subcutaneous flag is set to True, the corresponding compartment must also be defined and vice versa.
         :raises ValueError: If drug dosage is not a positive number.
-        :raises ValueError: If drug administration type is not 'bolus' or 'continuous'.
+        :raises ValueError: If drug administration type is not 'bolus' or 'continuous' or a valid dosage function expression.
         :raises ValueError: If there is not exactly one compartment with a 'central' type.
         :raises ValueError: If there is more than one compartment with a 'subcutaneous' type.
         :raises ValueError: If a compartment has a type other than 'central', 'subcutaneous', or 'peripheral'.
         :raises ValueError: If the volume of a compartment is not a positive number.
+        :raises ValueError: If neither a drug dosage nor a dosing schedule is given, or the dosing schedule is invalid.
+        :raises ValueError: If the edges are invalid, or refer to unknown or ambiguous compartment names.
         """
         basic_pars = self.sys_config['basic_parameters']
         sys_config_cp = self.sys_config.copy()
@@ -66,16 +124,23 @@ class Parser:
                              "defined and vice versa.")
         if not isinstance(basic_pars['time_span'], int) or basic_pars['time_span'] <= 0:
             raise ValueError("Time span must be positive integer.")
-        try:
-            dosage_func = lambda x: eval(basic_pars['dose'])
-            dosage_func(10)
-        except:
-            if not isinstance(basic_pars['dose'], list) or basic_pars['dose'][1] not in ["bolus", "continuous"]:
-                raise ValueError("Drug administration type must be 'bolus' or 'continuous' or a function expression "
-                                 "containing 'x', like 'np.cos(x +3)'")
-        if not isinstance(basic_pars['dose'],str):
+        if 'dose' not in basic_pars:
+            if 'dosing_schedule' not in basic_pars:
+                raise ValueError("Either a drug dosage or a dosing schedule must be given.")
+        elif isinstance(basic_pars['dose'], str):
+            try:
+                compile_dose_expression(basic_pars['dose'])
+            except ValueError as error:
+                raise ValueError(f"{error} Drug administration type must be 'bolus' or 'continuous' or a function "
+                                 "expression containing 'x', like 'np.cos(x +3)'")
+        elif not isinstance(basic_pars['dose'], list) or basic_pars['dose'][1] not in ["bolus", "continuous"]:
+            raise ValueError("Drug administration type must be 'bolus' or 'continuous' or a function expression "
+                             "containing 'x', like 'np.cos(x +3)'")
+        if 'dose' in basic_pars and not isinstance(basic_pars['dose'],str):
             if type(basic_pars['dose'][0]) not in [int, float] or basic_pars['dose'][0] <= 0:
                 raise ValueError("Drug dosage must be positive number.")
+        if 'dosing_schedule' in basic_pars:
+            self.check_dosing_schedule(basic_pars)
 
         if [i['type'] for i in compartments_sorted].count('central') != 1:
             raise ValueError("One and only one of the compartments must have a 'central' type")
@@ -86,5 +151,106 @@ class Parser:
                 raise ValueError(f"The {compartment['name']} compartment can be central, subcutaneous, or peripheral")
             if compartment['volume'] is None or compartment['volume'] <= 0:
                 raise ValueError(f"The volume of compartment {compartment['name']} must be positive number.")
+        if 'edges' in basic_pars:
+            self.check_edges(basic_pars, compartments_sorted)
 
+        self.index_map = self.build_index_map(compartments_sorted)
         return [basic_pars, compartments_sorted]
+
+    @staticmethod
+    def build_index_map(compartments):
+        """
+        Builds the canonical index map of the model state from the sorted compartments (as returned by
+        :meth:`construct`), i.e. the position of each compartment in the state vector of the model: the central
+        compartment first, then the peripheral compartments, then the subcutaneous compartment (if present).
+        The same map is used for the state, the rate matrix and all per-compartment parameter arrays.
+
+        :param compartments: The individual compartment parameters, sorted as by :meth:`construct`.
+        :type compartments: list
+        :return: A dictionary with the keys:
+            - names (list): The compartment names, in state order.
+            - central (int): The index of the central compartment.
+            - peripheral (list): The indices of the peripheral compartments.
+            - subcutaneous (int): The index of the subcutaneous compartment, or None.
+        :rtype: dict
+        """
+        types = [compartment['type'] for compartment in compartments]
+        return {'names': [compartment['name'] for compartment in compartments],
+                'central': types.index('central'),
+                'peripheral': [i for i, type in enumerate(types) if type == 'peripheral'],
+                'subcutaneous': types.index('subcutaneous') if 'subcutaneous' in types else None}
+
+    @staticmethod
+    def check_edges(basic_pars, compartments):
+        """
+        Validates the edges in the basic parameters, i.e. additional directed flows between compartments beyond the
+        exchange of each peripheral compartment with the central one. Each edge is a dictionary with the keys:
+            - from (str): The name of the compartment the flow leaves.
+            - to (str): The name of the compartment the flow enters.
+            - rate (number): The (positive) flow rate; the amount flowing per unit time is the rate times the
+              concentration in the 'from' compartment.
+
+        :param basic_pars: The model's basic parameters, containing 'edges'.
+        :type basic_pars: dict
+        :param compartments: The individual compartment parameters.
+        :type compartments: list
+
+        :raises ValueError: If the edges are not a list of valid edges, if an edge refers to an unknown compartment
+            or to a name shared by several compartments, or if an edge is given twice.
+        """
+        edges = basic_pars['edges']
+        if not isinstance(edges, list) or not all(isinstance(edge, dict) for edge in edges):
+            raise ValueError("The edges must be a list of edges.")
+        names = [compartment['name'] for compartment in compartments]
+        seen = set()
+        for edge in edges:
+            if set(edge.keys()) != {"from", "to", "rate"}:
+                raise ValueError(f"An edge must have exactly the attributes 'from', 'to' and 'rate', not {sorted(edge)}.")
+            for name in (edge['from'], edge['to']):
+                if names.count(name) == 0:
+                    raise ValueError(f"An edge refers to the unknown compartment '{name}'.")
+                if names.count(name) > 1:
+                    raise ValueError(f"An edge refers to the compartment name '{name}', which is ambiguous.")
+            if edge['from'] == edge['to']:
+                raise ValueError(f"The edge from '{edge['from']}' must lead to another compartment.")
+            if type(edge['rate']) not in [int, float] or edge['rate'] <= 0:
+                raise ValueError("The rate of an edge must be positive number.")
+            if (edge['from'], edge['to']) in seen:
+                raise ValueError(f"The edge from '{edge['from']}' to '{edge['to']}' is given more than once.")
+            seen.add((edge['from'], edge['to']))
+
+    @staticmethod
+    def check_dosing_schedule(basic_pars):
+        """
+        Validates the dosing schedule in the basic parameters, and fills in the default route and duration of its events.
+        The dosing schedule is a list of dosing events, each a dictionary with the keys:
+            - time (number): The time of administration, within the time span.
+            - amount (number): The (positive) amount of drug administered.
+            - route (str, optional): The compartment the drug is administered into, 'central' or 'subcutaneous'.
+              Defaults to 'subcutaneous' if the model has a subcutaneous compartment, otherwise to 'central'.
+            - duration (number, optional): The duration of an infusion, or 0 for a bolus. Defaults to 0.
+
+        :param basic_pars: The model's basic parameters, containing a 'dosing_schedule'.
+        :type basic_pars: dict
+
+        :raises ValueError: If the dosing schedule is not a non-empty list of valid dosing events.
+        """
+        schedule = basic_pars['dosing_schedule']
+        if not isinstance(schedule, list) or len(schedule) == 0 or not all(isinstance(e, dict) for e in schedule):
+            raise ValueError("The dosing schedule must be a non-empty list of dosing events.")
+        for event in schedule:
+            unknown = set(event.keys()) - {"time", "amount", "route", "duration"}
+            if len(unknown) != 0:
+                raise ValueError(f"Unknown dosing event attributes: {sorted(unknown)}.")
+            event.setdefault('route', 'subcutaneous' if basic_pars['subcutaneous'] == 1 else 'central')
+            event.setdefault('duration', 0)
+            if type(event.get('time')) not in [int, float] or not 0 <= event['time'] < basic_pars['time_span']:
+                raise ValueError("The time of a dosing event must be a number within the time span.")
+            if type(event.get('amount')) not in [int, float] or event['amount'] <= 0:
+                raise ValueError("The amount of a dosing event must be positive number.")
+            if type(event['duration']) not in [int, float] or event['duration'] < 0:
+                raise ValueError("The duration of a dosing event must be a non-negative number.")
+            if event['route'] not in ['central', 'subcutaneous'] or (
+                    event['route'] == 'subcutaneous' and basic_pars['subcutaneous'] != 1):
+                raise ValueError("The route of a dosing event must be 'central', or 'subcutaneous' "
+                                 "if the model has a subcutaneous compartment.")
@@ -0,0 +1,57 @@
+"""
+This module contains unit tests for the closed-form solver in the analytic module.
+"""
+import numpy as np
+import scipy.linalg
+import pytest
+from PKPy.analytic import propagate, propagate_sensitivities
+
+
+@pytest.mark.parametrize("rate_out", [1.0, 0.0])
+def test_propagate_matches_expm(rate_out):
+    """
+    Test the batched solution against scipy.linalg.expm of the augmented system, both for a diagonalisable
+    system and for a defective one (no elimination under constant input).
+    """
+    A = np.array([[-(rate_out + 1.0) / 600, 1.0 / 300, 2.0],
+                  [1.0 / 600, -1.0 / 300, 0.0],
+                  [0.0, 0.0, -2.0]])
+    u = np.array([0.0, 0.0, 20.0])
+    y0 = np.array([1.0, 2.0, 3.0])
+    times = np.array([0.0, 0.5, 10.0, 1000.0])
+
+    M = np.zeros((4, 4))
+    M[:3, :3], M[:3, 3] = A, u
+    expected = np.stack([(scipy.linalg.expm(M * t) @ np.append(y0, 1.0))[:3] for t in times], axis=-1)
+
+    assert np.allclose(propagate(A, u, y0, times), expected, rtol=1e-8, atol=1e-8)
+    batched = propagate(np.stack([A, A]), np.stack([u, u]), np.stack([y0, y0]), times)
+    assert batched.shape == (2, 3, 4)
+    assert np.allclose(batched[1], expected, rtol=1e-8, atol=1e-8)
+
+
+def test_propagate_sensitivities_scales():
+    """
+    Test the sensitivities of a model with many compartments and timesteps against the block matrix exponential,
+    within a time bound that the contraction over all compartment indices at once would exceed by far.
+    """
+    import time
+    from PKPy.benchmark import synthetic_config
+    from PKPy.model import Model
+    model = Model(synthetic_config(40, True, 1000))
+    n = len(model.names)
+    pairs = [(name, 'volume') for name in model.names]
+    dA, _ = model._parameter_derivatives(pairs)
+    start = time.perf_counter()
+    _, s = propagate_sensitivities(model.rate_matrix, model._linear_dosing(), model.initial_amounts, np.zeros((n, n)),
+                                   dA, np.arange(1000.0))
+    assert time.perf_counter() - start < 10
+    assert s.shape == (n, n, 1000)
+
+    p, t = 3, 500
+    M = np.zeros((2 * (n + 1), 2 * (n + 1)))
+    M[:n, :n] = M[n + 1:2 * n + 1, n + 1:2 * n + 1] = model.rate_matrix
+    M[:n, n] = M[n + 1:2 * n + 1, 2 * n + 1] = model._linear_dosing()
+    M[:n, n + 1:2 * n + 1] = dA[p]
+    expected = (scipy.linalg.expm(M * t) @ np.append(np.zeros(n + 1), np.append(model.initial_amounts, 1.0)))[:n]
+    assert np.allclose(s[p, :, t], expected, rtol=1e-6, atol=1e-9 * np.abs(expected).max())
@@ -0,0 +1,35 @@
+"""
+This module contains smoke tests for the benchmark harness in the benchmark module.
+"""
+import json
+from PKPy.benchmark import synthetic_config, run, compare, main
+from PKPy.system_parser import Parser
+
+
+def test_synthetic_config(tmp_path):
+    """
+    Test that synthetic configurations are valid system configurations of the requested size.
+    """
+    path = tmp_path / 'system.json'
+    path.write_text(json.dumps(synthetic_config(5, True, 100)))
+    basic_params, compartments = Parser(str(path)).construct()
+    assert len(compartments) == 7 and compartments[-1]['type'] == 'subcutaneous'
+
+
+def test_run_and_compare(tmp_path):
+    """
+    Test that the benchmark records every measurement, and that regressions against a baseline are reported.
+    """
+    results = run(peripheral=(2,), subcutaneous=(True,), time_spans=(50,), plot=False)
+    case = results['results'][0]
+    assert case['rhs_evals'] > 0 and case['peak_memory_bytes'] > 0 and case['plot_s'] is None
+    assert compare(results, results) == []
+
+    slower = json.loads(json.dumps(results))
+    slower['results'][0]['rhs_evals'] *= 2
+    assert [regression[1] for regression in compare(slower, results)] == ['rhs_evals']
+
+    output = tmp_path / 'benchmark.json'
+    assert main(['--peripheral', '1', '--time-span', '20', '--no-subcutaneous', '--output', str(output)]) == 0
+    assert main(['--peripheral', '1', '--time-span', '20', '--no-subcutaneous', '--no-plot',
+                 '--output', str(tmp_path / 'new.json'), '--baseline', str(output), '--tolerance', '1000']) == 0
@@ -0,0 +1,68 @@
+"""
+This module contains unit tests for the solution cache in the cache module.
+"""
+import os
+import numpy as np
+import pytest
+from PKPy.model import Model
+from PKPy.cache import SolutionCache
+
+file = os.path.join(os.path.dirname(__file__), "test_model_subc.json")
+
+
+def test_solve_with_cache(tmp_path):
+    """
+    Test that repeated solves are served from the cache, in memory and on disk, and that changing the model or
+    the solver options misses the cache.
+    """
+    cache = SolutionCache(str(tmp_path))
+    model = Model(file)
+    first = model.solve(method='analytic', save=False, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    second = model.solve(method='analytic', save=False, cache=cache)
+    assert cache.hits == 1
+    for name in first:
+        assert np.array_equal(first[name], second[name])
+    with pytest.raises(ValueError):
+        second[name][0] = 1.0
+
+    # a new cache on the same directory finds the solution on disk
+    disk_cache = SolutionCache(str(tmp_path))
+    third = Model(file).solve(method='analytic', save=False, cache=disk_cache)
+    assert disk_cache.hits == 1 and np.array_equal(third[name], first[name])
+
+    model.solve(method='LSODA', save=False, cache=cache)
+    changed = Model.from_config({'subcutaneous': 1, 'time_span': 10000, 'dose': [5, 'continuous']},
+                                model.config[1])
+    changed.solve(method='analytic', save=False, cache=cache)
+    assert cache.misses == 3
+
+    # changing the dosing, time span or parameters of a model after construction misses the cache
+    model.dose_constant = 1000
+    assert not np.array_equal(model.solve(method='analytic', save=False, cache=cache)[name], first[name])
+    model.time_span = 100
+    assert len(model.solve(method='analytic', save=False, cache=cache)[name]) == 100
+    model.dosing_schedule = [{'time': 10, 'amount': 50, 'route': 'central', 'duration': 0}]
+    model.solve(method='analytic', save=False, cache=cache)
+    model.set_parameters({(name, 'volume'): 123})
+    model.solve(method='analytic', save=False, cache=cache)
+    assert cache.misses == 7
+
+
+def test_cache_eviction(tmp_path):
+    """
+    Test that the least recently used solutions are evicted when the cache exceeds its size bounds.
+    """
+    series = {'a': np.zeros(100)}     # 800 bytes
+    cache = SolutionCache(str(tmp_path), max_memory_bytes=2000, max_disk_bytes=2500)
+    for key in ['k1', 'k2', 'k3']:
+        cache.put(key, series)
+        os.utime(tmp_path / f'{key}.pkpy', (0, int(key[1])))     # distinct modification times
+    assert list(cache._memory) == ['k2', 'k3']
+    assert sorted(os.listdir(tmp_path)) == ['k2.pkpy', 'k3.pkpy']
+
+    assert cache.get('k2') is not None
+    cache.put('k4', series)
+    assert list(cache._memory) == ['k2', 'k4']
+    cache.clear()
+    assert cache.get('k2') is None and os.listdir(tmp_path) == []
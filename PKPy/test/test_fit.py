@@ -0,0 +1,80 @@
+"""
+This module contains unit tests for the parameter estimation in the fit module.
+"""
+import os
+import numpy as np
+import pytest
+from PKPy.model import Model
+from PKPy.fit import fit
+
+file = os.path.join(os.path.dirname(__file__), "test_model_schedule.json")
+free_params = [('bloodstream', 'volume'), ('bloodstream', 'rate_out'), ('liver', 'rate_in')]
+
+
+def observed(model, times):
+    """
+    Concentration samples of the model at the given times.
+    """
+    timeseries, _ = model.sensitivities([], times=times)
+    return {C.name: (times, timeseries[C.name] / C.volume) for C in model.compartment_list if C.name != 'subcutaneous'}
+
+
+def test_fit_recovers_parameters():
+    """
+    Test that fitting from perturbed parameters recovers the parameters that generated the samples,
+    and that the model is left with the fitted parameters.
+    """
+    times = np.array([2.0, 5.0, 20.0, 60.0, 110.0, 160.0, 250.0, 305.0, 400.0])
+    observations = observed(Model(file), times)
+
+    model = Model(file)
+    model.set_parameters({('bloodstream', 'volume'): 900, ('bloodstream', 'rate_out'): 0.5, ('liver', 'rate_in'): 2.0})
+    result = model.fit(observations, free_params, xtol=1e-12, ftol=1e-12)
+    assert result['success'] and result['cost'] < 1e-12
+    assert np.allclose([result['parameters'][pair] for pair in free_params], [600, 1.0, 1.0], rtol=1e-5)
+    assert [C.volume for C in model.compartment_list if C.name == 'bloodstream'] == [result['parameters'][free_params[0]]]
+    assert result['n_solves'] > 0 and result['time'] > 0 and len(result['starts']) == 1
+
+    with pytest.raises(ValueError):
+        fit(model, observations, [('liver', 'initial_amount')])
+    with pytest.raises(ValueError):
+        fit(model, observations, [('kidney', 'volume')])
+    with pytest.raises(ValueError):
+        fit(model, {'kidney': (times, times)}, free_params)
+
+
+def test_fit_multistart():
+    """
+    Test that independent starts run on worker processes, each within the bounds and with its own
+    timing and solve count, and that the best start is returned.
+    """
+    times = np.linspace(1, 450, 12)
+    observations = observed(Model(file), times)
+    bounds = {pair: (0.1, 5.0) for pair in free_params[1:]}
+
+    result = fit(Model(file), observations, free_params, n_starts=4, bounds=bounds, seed=0, max_workers=2)
+    assert len(result['starts']) == 4
+    assert result['cost'] == min(start['cost'] for start in result['starts'])
+    assert result['n_solves'] == sum(start['n_solves'] for start in result['starts'])
+    assert all(start['n_solves'] > 0 and start['time'] > 0 for start in result['starts'])
+    assert all(0.1 <= start['parameters'][pair] <= 5.0 for start in result['starts'] for pair in free_params[1:])
+    assert np.allclose([result['parameters'][pair] for pair in free_params], [600, 1.0, 1.0], rtol=1e-3)
+
+
+def test_fit_multistart_live_model():
+    """
+    Test that the worker processes of a multi-start fit solve the model as it is, including changes made after
+    its construction, rather than as it was configured.
+    """
+    times = np.linspace(1, 450, 12)
+    truth = Model(file)
+    truth.dosing_schedule = [dict(event, amount=2 * event['amount']) for event in truth.dosing_schedule]
+    truth.dose_constant = 1.0
+    observations = observed(truth, times)
+
+    model = Model(file)
+    model.dosing_schedule, model.dose_constant = truth.dosing_schedule, truth.dose_constant
+    model.set_parameters({('bloodstream', 'volume'): 900})
+    result = fit(model, observations, free_params[:1], n_starts=2, seed=0, max_workers=2, xtol=1e-12, ftol=1e-12)
+    assert all(start['cost'] < 1e-12 for start in result['starts'])
+    assert np.isclose(result['parameters'][free_params[0]], 600, rtol=1e-5)
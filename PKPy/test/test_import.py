@@ -0,0 +1,23 @@
+"""
+This module contains a regression test for the import time of PKPy: importing the package must not load the
+optional plotting dependencies, which are only needed (and imported) by Model.plot.
+"""
+import subprocess
+import sys
+import os
+
+
+def test_import_does_not_load_plotting():
+    """
+    Test, in a fresh interpreter, that importing PKPy and solving a model loads neither matplotlib nor mpl_toolkits.
+    """
+    code = ("import sys, PKPy\n"
+            "model = PKPy.Model(sys.argv[1])\n"
+            "model.solve(method='analytic', save=False)\n"
+            "print(sorted({name.split('.')[0] for name in sys.modules} & {'matplotlib', 'mpl_toolkits', 'PIL'}))")
+    systemfile = os.path.join(os.path.dirname(__file__), 'test_model_subc.json')
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_root, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.run([sys.executable, '-c', code, systemfile], capture_output=True, text=True, check=True,
+                            env=env).stdout
+    assert output.strip() == '[]'
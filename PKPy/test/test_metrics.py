@@ -0,0 +1,54 @@
+"""
+This module contains unit tests for the pharmacokinetic summary metrics in the metrics module.
+"""
+import numpy as np
+import pytest
+from PKPy.metrics import MetricsAccumulator, summarize
+
+
+def test_summarize_single_dose():
+    """
+    Test the metrics of an absorption-elimination curve against their closed-form values.
+    """
+    t = np.arange(0, 200, 0.01)
+    curve = 10 * (np.exp(-0.1 * t) - np.exp(-t))
+    metrics = summarize({'central': curve, 'zero': np.zeros_like(t)}, step=0.01, threshold=5.0, chunk_size=777)
+
+    central = metrics['central']
+    tmax = np.log(10) / 0.9
+    assert np.isclose(central['tmax'], tmax, atol=0.01)
+    assert np.isclose(central['cmax'], 10 * (np.exp(-0.1 * tmax) - np.exp(-tmax)), rtol=1e-6)
+    assert np.isclose(central['auc'], 10 * (1 / 0.1 - 1), rtol=1e-4)
+    assert np.isclose(central['half_life'], np.log(2) / 0.1, rtol=1e-6)
+    assert central['trough'] == curve[-1]
+    above = t[curve > 5.0]
+    assert np.isclose(central['time_above'], above[-1] - above[0], atol=0.02)
+    assert metrics['zero']['auc'] == 0 and np.isnan(metrics['zero']['half_life'])
+
+
+def test_summarize_population_and_volumes():
+    """
+    Test that population arrays are summarized per individual and compartment, that volumes convert
+    amounts to concentrations, and that the result does not depend on the chunk size.
+    """
+    rng = np.random.default_rng(0)
+    amounts = rng.random((4, 3, 1000))
+    volumes = np.array([1.0, 2.0, 4.0])
+    metrics = summarize(amounts, volumes=volumes, threshold=0.1)
+    chunked = summarize(amounts, volumes=volumes, threshold=0.1, chunk_size=33)
+
+    concentrations = amounts / volumes[:, None]
+    assert metrics['auc'].shape == (4, 3)
+    assert np.allclose(metrics['auc'], np.sum((concentrations[..., 1:] + concentrations[..., :-1]) / 2, axis=-1))
+    assert np.array_equal(metrics['cmax'], concentrations.max(axis=-1))
+    assert np.array_equal(metrics['tmax'], concentrations.argmax(axis=-1))
+    assert np.array_equal(metrics['time_above'], (concentrations > 0.1).sum(axis=-1))
+    peak = concentrations.argmax(axis=-1)
+    trough = [[c[p + 1:].min() if p + 1 < c.size else np.nan for c, p in zip(row, peaks)]
+              for row, peaks in zip(concentrations, peak)]
+    assert np.allclose(metrics['trough'], trough, equal_nan=True)
+    for name in metrics:
+        assert np.allclose(metrics[name], chunked[name], equal_nan=True)
+
+    with pytest.raises(ValueError):
+        MetricsAccumulator(10).result()
@@ -1,12 +1,18 @@
 import pytest
 import sys
 import os
-from PKPy.model import Model, Compartment
+import json
+import numpy as np
+import scipy.sparse
+from PKPy import model as model_module
+from PKPy.model import Model, Compartment, load_timeseries, stiffness_ratio, SOLVE_HOOKS
+from PKPy.model import assemble_rate_matrix, assemble_sparse_rate_matrix
 
 
 current_dir = os.path.dirname(__file__)
 
 file = os.path.join(current_dir, "test_model_subc.json")
+schedule_file = os.path.join(current_dir, "test_model_schedule.json")
 
 def test_compartment_constructor():
     """
@@ -43,9 +49,14 @@ def test_dose():
     assert model.dose(0) == model.dose_constant
     assert model.dose(1) == model.dose_constant
 
-    model.dose_type = 'bolus'
-    assert model.dose(0) == model.dose_constant
+    model.dose_type = 'bolus'     # administered as a jump of the state at time 0, not as a rate
+    assert model.dose(0) == 0
     assert model.dose(1) == 0
+    assert np.array_equal(model.dose(np.array([0.0, 1.0])), [0, 0])
+
+    model.dose_type = 'np.cos(x) + 1'
+    assert model.dose(0) == 2
+    assert np.allclose(model.dose(np.array([0.0, np.pi])), [2, 0])
 
 def test_solve():
     """
@@ -106,7 +117,416 @@ def test_ode_system_values():
         assert len(deriv) == len(expected_derivatives)
         for val, expected_val in zip(deriv, expected_derivatives):
             assert val == expected_val
-            
+
+def test_linear_ode_system_matches_ode_system():
+    """
+    Test that the precompiled rate-matrix formulation reproduces the per-compartment ODE system.
+    """
+    model = Model(file)
+    y = np.array([15.0, 3.0, 9.0])
+    for t in [0.0, 5.0]:
+        assert np.allclose(model.linear_ode_system(t, y), model.ode_system(t, y), rtol=1e-12, atol=0)
+    assert np.array_equal(model.jacobian(5.0, y), model.rate_matrix)
+
+@pytest.mark.parametrize("method", ['RK45', 'BDF'])
+def test_solve_engines_agree(method):
+    """
+    Test that the 'matrix' and 'compartment' engines give the same solution.
+    """
+    model = Model(file)
+    matrix = model.solve(engine='matrix', method=method)
+    compartment = model.solve(engine='compartment', method=method)
+    for name in matrix:
+        assert np.allclose(matrix[name], compartment[name], rtol=1e-4, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        model.solve(engine='unknown')
+
+def test_solve_analytic():
+    """
+    Test that the closed-form solution agrees with numerical integration for continuous dosing,
+    and that a bolus is administered as an instantaneous dose at time 0.
+    """
+    model = Model(file)
+    analytic = model.solve(method='analytic')
+    numerical = model.solve(method='LSODA')
+    for name in analytic:
+        assert np.allclose(analytic[name], numerical[name], rtol=1e-3, atol=1e-3)
+
+    model.dose_type = 'bolus'
+    bolus = model.solve(method='analytic')
+    assert bolus[model.subcutaneous.name][0] == model.dose_constant
+
+    model.dose_type = 'np.sin(x) + 1'
+    with pytest.raises(ValueError):
+        model.analytic_solution([0, 1], [0, 0, 0])
+    assert len(model.solve(method='analytic')[model.central.name]) == model.time_span
+
+def test_bolus_all_methods():
+    """
+    Test that a bolus is administered at time 0 by every method, so that the numerical solutions, the population
+    solutions and the sensitivities agree with the closed-form solution over the whole time span.
+    """
+    with open(file) as f:
+        config = json.load(f)
+    config['basic_parameters'].update({'time_span': 200, 'dose': [20, 'bolus']})
+    model = Model(config)
+    analytic = model.solve(method='analytic', save=False)
+    assert analytic['subcutaneous'][0] == 20 and analytic['bloodstream'][10] > 1
+    for method in ['RK45', 'BDF', 'LSODA']:
+        for engine in ['matrix', 'compartment']:
+            numerical = model.solve(engine=engine, method=method, save=False)
+            assert all(np.allclose(numerical[name], analytic[name], rtol=1e-2, atol=1e-2) for name in analytic)
+    dense = model.solve_dense(method='RK45')
+    assert np.allclose(dense([10.0]).ravel(), [analytic[name][10] for name in model.names], rtol=1e-3, atol=1e-6)
+
+    volumes = model.parameter_table()['volume'][None]
+    assert np.allclose(model.solve_population({'volume': volumes}, method='RK45'),
+                       model.solve_population({'volume': volumes}), rtol=1e-3, atol=1e-3)
+    timeseries, sensitivities = model.sensitivities([('bloodstream', 'volume')], method='RK45', rtol=1e-8, atol=1e-8)
+    _, expected = model.sensitivities([('bloodstream', 'volume')])
+    assert np.allclose(timeseries['bloodstream'], analytic['bloodstream'], rtol=1e-4, atol=1e-6)
+    assert np.allclose(sensitivities[('bloodstream', 'volume')], expected[('bloodstream', 'volume')], rtol=1e-4,
+                       atol=1e-6)
+
+def test_solve_population():
+    """
+    Test that a batched population solve reproduces the single-model solution for every individual,
+    both in closed form and as a stacked ODE system.
+    """
+    model = Model(file)
+    volumes = model.parameter_table()['volume'] * np.array([[1.0], [0.5], [2.0]])
+    population = model.solve_population({'volume': volumes})
+    assert population.shape == (3, len(model.compartment_list), model.time_span)
+
+    reference = model.solve(method='analytic')
+    for i, C in enumerate(model.compartment_list):
+        assert np.allclose(population[0, i], reference[C.name])
+    assert not np.allclose(population[1], population[0])
+    assert np.allclose(model.solve_population({'volume': volumes}, method='BDF'), population, rtol=1e-3, atol=1e-2)
+
+    with pytest.raises(ValueError):
+        model.solve_population({'clearance': volumes})
+    with pytest.raises(ValueError):
+        model.solve_population({'volume': volumes[:, :2]})
+
+def test_solve_dosing_schedule():
+    """
+    Test that a dosing schedule of boluses and an infusion is applied at the right times and into the right
+    compartments, and that the piecewise numerical and closed-form solutions agree.
+    """
+    model = Model(schedule_file)
+    assert [event['time'] for event in model.dosing_schedule] == [0, 100, 300.5]
+    assert model.dosing_schedule[0]['route'] == 'subcutaneous' and model.dosing_schedule[0]['duration'] == 0
+
+    analytic = model.solve(method='analytic')
+    numerical = model.solve(method='LSODA')
+    for name in analytic:
+        assert np.allclose(analytic[name], numerical[name], rtol=1e-2, atol=1e-3)
+
+    subcutaneous, central = analytic[model.subcutaneous.name], analytic[model.central.name]
+    assert subcutaneous[0] == 100 and central[0] == 0
+    assert subcutaneous[300] < 1e-10 and np.isclose(subcutaneous[301], 100 * np.exp(-2.0 * 0.5))
+    # during the infusion the central compartment receives 10 per unit time
+    rhs = model.rate_matrix @ np.array([analytic[C.name][120] for C in model.compartment_list])
+    assert np.isclose(np.gradient(central)[120], rhs[0] + 10, rtol=1e-2)
+
+def test_solve_chunks():
+    """
+    Test that a streamed solution, both as yielded and as written to disk window by window,
+    is identical to the solution of Model.solve().
+    """
+    model = Model(schedule_file)
+    expected = model.solve(save=False)
+
+    windows = list(model.solve_chunks(chunk_size=37))
+    assert [len(times) for times, _ in windows] == [37] * 13 + [500 - 13 * 37]
+    assert np.array_equal(np.concatenate([times for times, _ in windows]), np.arange(model.time_span))
+    written = load_timeseries(model.results_path)
+    for name in expected:
+        assert np.array_equal(np.concatenate([window[name] for _, window in windows]), expected[name])
+        assert np.array_equal(written[name], expected[name])
+
+def test_stiffness_and_auto_method():
+    """
+    Test the stiffness estimate from the eigenvalue spread, and that 'auto' selects an implicit solver for
+    stiff models and an explicit one otherwise.
+    """
+    assert stiffness_ratio(np.diag([-1.0, -1e-3]), 1e6) == 1e3
+    assert stiffness_ratio(np.diag([-1.0, -1e-6]), 100) == 100      # time scales beyond the time span
+    assert stiffness_ratio(np.zeros((2, 2)), 100) == 0
+
+    model = Model(file)
+    assert model.select_method() == 'BDF'
+    model.time_span = 100
+    assert model.select_method() == 'RK45'
+
+def test_solve_tolerances():
+    """
+    Test that tighter tolerances bring the numerical solution closer to the closed-form one.
+    """
+    model = Model(file)
+    analytic = model.solve(method='analytic', save=False)
+    errors = []
+    for rtol, atol in [(1e-3, 1e-6), (1e-8, 1e-8)]:
+        numerical = model.solve(method='auto', rtol=rtol, atol=atol, save=False)
+        errors.append(max(np.max(np.abs(numerical[name] - analytic[name])) for name in analytic))
+    assert errors[1] < errors[0] / 100
+    assert np.allclose(model.solve(method='RK45', max_step=0.5, save=False)[model.central.name],
+                       analytic[model.central.name], rtol=1e-3)
+
+def test_solve_stats_and_hooks():
+    """
+    Test the run statistics of solve, and that they are passed to the hooks.
+    """
+    model = Model(file)
+    received = []
+    SOLVE_HOOKS.append(lambda model, stats: received.append(('global', stats)))
+    try:
+        model.solve(method='RK45', profile=True, hooks=[lambda model, stats: received.append(('local', stats))])
+    finally:
+        SOLVE_HOOKS.clear()
+    stats = model.solve_stats
+    assert [name for name, _ in received] == ['global', 'local'] and received[0][1] is stats
+    assert stats['method'] == 'RK45' and stats['n_steps'] > 0 and stats['n_rejected'] >= 0
+    assert stats['nfev'] == 6 * (stats['n_steps'] + stats['n_rejected']) + 2     # RK45: six evaluations per attempt
+    assert stats['dose_time'] > 0 and stats['rhs_time'] > 0
+    assert stats['bytes_written'] == os.path.getsize(model.results_path)
+    assert set(stats['phase_times']) == {'setup', 'integrate', 'write', 'total'}
+    assert model.dose.__func__ is Model.dose     # the profiling wrappers are removed
+
+    model.solve(method='auto', save=False)
+    assert model.solve_stats['method'] == 'BDF' and model.solve_stats['njev'] > 0
+    assert model.solve_stats['n_rejected'] is None and model.solve_stats['bytes_written'] == 0
+
+def test_solve_dense():
+    """
+    Test that the continuous solution agrees with the solution on the grid of timesteps, and that Cmax, Tmax
+    and AUC are computed from it.
+    """
+    model = Model(schedule_file)
+    times = np.arange(model.time_span)
+    for method in ['analytic', 'RK45']:
+        grid = model.solve(method=method, save=False)
+        solution = model.solve_dense(method=method)
+        assert all(np.allclose(model.at(times)[name], grid[name], rtol=1e-9, atol=1e-9) for name in grid)
+    assert len(solution.knots) < model.time_span     # one knot per solver step
+    assert list(model.at(300.5, compartments=['subcutaneous'])) == ['subcutaneous']
+    assert model.at(300.5)['subcutaneous'] > model.at(300.49)['subcutaneous'] + 99     # just after the bolus
+    with pytest.raises(ValueError):
+        model.at([-1, 10])
+    with pytest.raises(KeyError):
+        model.at(10, compartments=['unknown'])
+
+    model.solve_dense(method='analytic')
+    exposure = model.exposure(chunk_size=50)
+    # two boluses of 100 into the subcutaneous compartment, each absorbed at rate 2
+    assert np.isclose(exposure['subcutaneous']['auc'], 100, rtol=1e-6)
+    assert exposure['subcutaneous']['cmax'] == 100 and exposure['subcutaneous']['tmax'] == 0
+    central = grid['bloodstream']
+    assert np.isclose(exposure['bloodstream']['cmax'], central.max()) and exposure['bloodstream']['tmax'] == central.argmax()
+    whole = model.exposure()
+    assert all(np.isclose(whole[name]['auc'], exposure[name]['auc'], rtol=1e-12) for name in whole)
+    window = model.exposure(['liver'], start=100.5, end=200)['liver']
+    assert window['tmax'] == 200 and np.isclose(window['auc'], np.sum(grid['liver'][101:200]), rtol=1e-2)
+
+    # the knots of the closed-form solution are spaced by the time scales of the model, not by the timesteps
+    n_knots = len(model.solve_dense(method='analytic').knots)
+    model.time_span *= 1000
+    assert len(model.solve_dense(method='analytic').knots) < 2 * n_knots
+
+def test_dense_solution_follows_changes():
+    """
+    Test that the continuous solution is solved again, with the same options, when the parameters, dosing or time
+    span of the model change after solve_dense.
+    """
+    model = Model(file)
+    model.solve_dense(method='analytic')
+    before = model.at(50.0)['liver']
+    model.set_parameters({('liver', 'volume'): 100})
+    assert model.at(50.0)['liver'] != before
+    assert np.isclose(model.at(50.0)['liver'], Model.from_config(*model.config).solve_dense(method='analytic')(50.0)[1])
+    model.dose_constant = 40
+    assert np.isclose(model.exposure(end=100)['liver']['auc'],
+                      2 * Model.from_config(*model.config).exposure(end=100)['liver']['auc'], rtol=1e-3)
+    model.time_span = 20000
+    assert model.at(15000.0)['liver'] > 0 and len(model.dense_solution.knots) < 1000   # still the closed form
+
+def test_sensitivities():
+    """
+    Test the forward sensitivities against central finite differences of the closed-form solution,
+    and that the closed-form and integrated sensitivities agree.
+    """
+    import copy
+    from PKPy.system_parser import Parser
+    basic_params, compartments = Parser(schedule_file).construct()
+    model = Model.from_config(basic_params, compartments)
+    timeseries, sensitivities = model.sensitivities(method='analytic')
+    assert set(sensitivities) == {('bloodstream', 'volume'), ('bloodstream', 'rate_out'), ('liver', 'volume'),
+                                  ('liver', 'rate_in'), ('subcutaneous', 'rate_out')}
+    expected = model.solve(method='analytic', save=False)
+    assert all(np.allclose(timeseries[name], expected[name]) for name in expected)
+
+    for name, parameter in list(sensitivities) + [('bloodstream', 'initial_amount'), ('liver', 'initial_amount')]:
+        perturbed = []
+        for h in [1e-5, -1e-5]:
+            changed = copy.deepcopy(compartments)
+            compartment = next(c for c in changed if c['name'] == name)
+            compartment[parameter] = compartment[parameter] * (1 + h) if compartment[parameter] else h
+            solution = Model.from_config(basic_params, changed).solve(method='analytic', save=False)
+            perturbed.append((np.stack(list(solution.values())), compartment[parameter]))
+        finite_difference = (perturbed[0][0] - perturbed[1][0]) / (perturbed[0][1] - perturbed[1][1])
+        analytic = model.sensitivities([(name, parameter)])[1][(name, parameter)]
+        assert np.allclose(analytic, finite_difference, rtol=1e-4, atol=1e-6 * np.abs(analytic).max())
+
+    _, integrated = model.sensitivities(method='BDF', rtol=1e-8, atol=1e-8)
+    for pair in sensitivities:
+        assert np.allclose(integrated[pair], sensitivities[pair], rtol=1e-4, atol=1e-5 * np.abs(sensitivities[pair]).max())
+
+    with pytest.raises(ValueError):
+        model.sensitivities([('liver', 'colour')])
+    with pytest.raises(ValueError):
+        model.sensitivities([('kidney', 'volume')])
+
+def edge_config(n_peripheral):
+    """
+    A model with a chain of peripheral compartments, each also exchanging with the central compartment.
+    """
+    basic_params = {'time_span': 200, 'subcutaneous': 1, 'dose': [20, 'continuous'],
+                    'edges': [{'from': f'p{i}', 'to': f'p{i + 1}', 'rate': 0.5} for i in range(n_peripheral - 1)]
+                             + [{'from': f'p{n_peripheral - 1}', 'to': 'central', 'rate': 2.0}]}
+    compartments = [{'name': 'central', 'type': 'central', 'volume': 600, 'initial_amount': 0.0, 'rate_in': None,
+                     'rate_out': 1.0}]
+    compartments += [{'name': f'p{i}', 'type': 'peripheral', 'volume': 50.0 + i, 'initial_amount': 0.0,
+                      'rate_in': 0.1 * (i % 3), 'rate_out': None} for i in range(n_peripheral)]
+    compartments += [{'name': 'sc', 'type': 'subcutaneous', 'volume': 400, 'initial_amount': 0.0, 'rate_in': None,
+                      'rate_out': 2.0}]
+    return basic_params, compartments
+
+def test_edges():
+    """
+    Test that edges add directed flows to every formulation of the model, and that the sparse and dense
+    rate matrices and solutions agree.
+    """
+    model = Model.from_config(*edge_config(4))
+    assert model.edges[-1] == (4, 0, 2.0)
+    y = np.arange(1.0, 7.0)
+    assert np.allclose(model.linear_ode_system(3.0, y), model.ode_system(3.0, y), rtol=1e-12, atol=0)
+    flow = 2.0 * y[4] / 53.0
+    without_edge = edge_config(4)
+    without_edge[0]['edges'].pop()
+    assert np.allclose(model.linear_ode_system(3.0, y) - Model.from_config(*without_edge).linear_ode_system(3.0, y),
+                       [flow, 0, 0, 0, -flow, 0])
+
+    params = model.parameter_table()
+    assert np.allclose(assemble_sparse_rate_matrix(params['volume'], params['rate_in'], params['rate_out'], True,
+                                                   model.edges).toarray(),
+                       assemble_rate_matrix(params['volume'], params['rate_in'], params['rate_out'], True, model.edges))
+    analytic = model.solve(method='analytic', save=False)
+    for engine in ['matrix', 'compartment']:
+        numerical = model.solve(engine=engine, method='BDF', rtol=1e-8, atol=1e-8, save=False)
+        assert all(np.allclose(numerical[name], analytic[name], rtol=1e-5, atol=1e-5) for name in analytic)
+
+def test_sparse_system(monkeypatch):
+    """
+    Test that large models integrate the sparse rate matrix, with a sparse Jacobian, to the same solution.
+    """
+    dense = Model.from_config(*edge_config(30)).solve(method='BDF', save=False)
+    monkeypatch.setattr(model_module, 'SPARSE_THRESHOLD', 10)
+    model = Model.from_config(*edge_config(30))
+    assert scipy.sparse.issparse(model.jacobian(0, None))
+    assert model.sparse_rate_matrix.nnz < 5 * 32
+    # neither the dense rate matrix nor a dense eigendecomposition is needed to select the method
+    assert model._rate_matrix is None
+    assert model.select_method() == Model.from_config(*edge_config(30)).select_method() and model._rate_matrix is None
+    for time_span in [10, 1e6]:
+        assert np.isclose(stiffness_ratio(model.sparse_rate_matrix, time_span),
+                          stiffness_ratio(model.sparse_rate_matrix.toarray(), time_span))
+    for method in ['BDF', 'LSODA']:
+        sparse = model.solve(method=method, save=False)
+        assert all(np.allclose(sparse[name], dense[name], rtol=1e-2, atol=1e-3) for name in dense)
+
+def test_parameter_arrays():
+    """
+    Test that the parameters are held as arrays in the canonical state order of the Parser, that the initial
+    amounts are in that order too, and that copies and parameter changes do not affect the original model.
+    """
+    with open(file) as f:
+        config = json.load(f)
+    config['compartment_3']['initial_amount'] = 50.0
+    model = Model(config)
+    assert model.index_map == {'names': ['bloodstream', 'liver', 'subcutaneous'], 'central': 0, 'peripheral': [1],
+                               'subcutaneous': 2}
+    assert model.names == [C.name for C in model.compartment_list]
+    assert np.array_equal(model.volumes, [600, 300, 400]) and np.array_equal(model.rates_in, [0, 1, 0])
+    assert model.central.name == 'bloodstream' and model.subcutaneous.name == 'subcutaneous'
+    assert [C.name for C in model.other_compartments] == ['liver']
+
+    solution = model.solve(method='analytic', save=False)
+    assert np.allclose([solution[name][0] for name in model.names], [0, 50, 0])
+    y = np.array([15.0, 3.0, 9.0])
+    assert isinstance(model.ode_system(0, y), np.ndarray)
+
+    variant = model.copy()
+    variant.set_parameters({('liver', 'volume'): 30, ('liver', 'initial_amount'): 0})
+    assert model.volumes[1] == 300 and model.config[1][1]['volume'] == 300 and variant.volumes[1] == 30
+    assert variant.config_hash != model.config_hash
+    with pytest.raises(ValueError):
+        model.volumes[1] = 30     # the parameters are changed only by set_parameters, which reassembles the system
+
+    # the compartments are views of the parameter arrays, and write through to them
+    view = model.copy()
+    view.compartment_list[1].volume = 30
+    view.other_compartments[0].initial_amount = 0
+    assert view.volumes[1] == 30 and view.compartment_list[1].volume == 30 and view.config[1][1]['volume'] == 30
+    assert view.config_hash == variant.config_hash and model.compartment_list[1].volume == 300
+    assert np.allclose(view.solve(engine='matrix', save=False)['liver'], variant.solve(save=False)['liver'])
+    with pytest.raises(AttributeError):
+        view.central.name = 'plasma'
+    assert np.allclose(variant.ode_system(5.0, y), variant.linear_ode_system(5.0, y))
+    assert not np.allclose(variant.ode_system(5.0, y), model.ode_system(5.0, y))
+    edges = Model.from_config(*edge_config(6))
+    y = np.arange(1.0, 9.0)
+    assert np.allclose(edges.ode_system(2.0, y), edges.linear_ode_system(2.0, y), rtol=1e-12)
+
+def test_steady_state(monkeypatch):
+    """
+    Test the steady state under continuous dosing against its mass balance, and the periodic steady state
+    against the last dosing interval of a long solve of the repeated schedule.
+    """
+    model = Model(file)
+    steady = model.steady_state()
+    # the dose rate 20 is absorbed at rate 2 and eliminated at rate 1 from volume 600; the liver equilibrates
+    assert np.allclose([steady['subcutaneous'], steady['bloodstream'], steady['liver']], [10, 12000, 6000])
+    monkeypatch.setattr(model_module, 'SPARSE_THRESHOLD', 2)
+    assert np.allclose(list(Model(file).steady_state().values()), list(steady.values()))
+
+    with open(schedule_file) as f:
+        config = json.load(f)
+    config['basic_parameters'] = {'time_span': 24 * 60, 'subcutaneous': 1, 'dose': [1, 'continuous'],
+                                  'dosing_schedule': [event for k in range(60) for event in
+                                                      [{'time': 24 * k, 'amount': 100},
+                                                       {'time': 24 * k + 2.5, 'amount': 50, 'route': 'central',
+                                                        'duration': 4}]]}
+    for key in ['compartment_1', 'compartment_2', 'compartment_3']:
+        config[key]['volume'] /= 10
+    model = Model(config)
+    solution = model.solve(method='analytic', save=False)
+    periodic = model.steady_state(interval=24, times=np.arange(24))
+    assert all(np.allclose(periodic[name], solution[name][-24:], rtol=1e-5) for name in solution)
+    start, end = model.steady_state(interval=24), model.steady_state(interval=24, times=[24 - 1e-9])
+    assert all(np.isclose(start[name], end[name][0]) for name in solution)
+
+    with pytest.raises(ValueError):
+        model.steady_state(interval=5)      # the infusion does not end within the interval
+    with pytest.raises(ValueError):
+        model.steady_state(times=[1, 2])
+    with pytest.raises(ValueError):
+        model.steady_state(interval=24, times=[30])
+    config['compartment_1']['rate_out'] = 0
+    with pytest.raises(ValueError):
+        Model(config).steady_state()
+
 if __name__ == '__main__':
     pytest.main()
  
\ No newline at end of file
@@ -8,7 +8,7 @@ import pytest
 
 @pytest.mark.parametrize(
     "test, expected, expect_raises",
-    [(f"PKPy/test/parser_tests_jsons/test_{test_number}.json", None, ValueError) for test_number in range(1, 9)])
+    [(f"PKPy/test/parser_tests_jsons/test_{test_number}.json", None, ValueError) for test_number in [*range(1, 9), *range(11, 15)]])
 def test_parser_for_errors(test, expected, expect_raises):
     """
     Test the Parser class for expected errors.
@@ -48,3 +48,40 @@ expected_values = [[{'subcutaneous': 0, "time_span": 1000, 'dose': [20, 'continu
 def test_parser_for_wrong_output(test, expected):
     from PKPy.system_parser import Parser
     assert Parser(test).construct() == expected
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["__import__('os').system('ls')", "y + 1", "np.load('file.npy')", "np.sin(x).__class__", "'text'", "np.sin(x"])
+def test_compile_dose_expression_rejects(expression):
+    """
+    Test that dosage function expressions outside of the supported subset are rejected.
+    """
+    from PKPy.system_parser import compile_dose_expression
+    with pytest.raises(ValueError):
+        compile_dose_expression(expression)
+
+
+def test_compile_dose_expression():
+    """
+    Test that a compiled dosage function is cached and evaluates on scalar and array times.
+    """
+    import numpy as np
+    from PKPy.system_parser import compile_dose_expression
+    dosage_function = compile_dose_expression("np.sin(x) + 100 * (x < 2)")
+    assert compile_dose_expression("np.sin(x) + 100 * (x < 2)") is dosage_function
+    assert dosage_function(1.0) == np.sin(1.0) + 100
+    assert np.allclose(dosage_function(np.array([1.0, 3.0])), [np.sin(1.0) + 100, np.sin(3.0)])
+    assert np.array_equal(compile_dose_expression("5")(np.zeros(3)), [5, 5, 5])
+
+
+def test_index_map():
+    """
+    Test that construct builds the canonical index map of the model state, with duplicate names kept in order.
+    """
+    from PKPy.system_parser import Parser
+    parser = Parser("PKPy/test/parser_tests_jsons/test_10.json")
+    basic_pars, compartments = parser.construct()
+    assert parser.index_map == {'names': ['bloodstream', 'adipose', 'adipose'], 'central': 0, 'peripheral': [1, 2],
+                                'subcutaneous': None}
+    assert Parser.build_index_map(compartments) == parser.index_map
@@ -0,0 +1,49 @@
+"""
+This module contains unit tests for the plotting helpers in the plotting module, and for Model.plot.
+"""
+import os
+import numpy as np
+import pytest
+from PKPy.model import Model
+from PKPy.plotting import decimate_minmax, plot_models
+
+file = os.path.join(os.path.dirname(__file__), "test_model_subc.json")
+
+
+def test_decimate_minmax():
+    """
+    Test that decimation keeps the extremes of every bucket, in time order, and leaves short series unchanged.
+    """
+    series = np.sin(np.linspace(0, 50, 100003)) + np.random.default_rng(0).normal(0, 0.1, 100003)
+    x, y = decimate_minmax(series, 100)
+    assert len(x) <= 2 * 101 + 2 and np.all(np.diff(x) > 0)
+    assert np.array_equal(y, series[x])
+    assert y.max() == series.max() and y.min() == series.min()
+    assert x[0] == 0 and x[-1] == len(series) - 1
+    for bucket in range(100):
+        chunk = series[bucket * 1000:(bucket + 1) * 1000]
+        assert chunk.max() in y and chunk.min() in y
+
+    x, y = decimate_minmax(series[:150], 100)
+    assert np.array_equal(x, np.arange(150)) and np.array_equal(y, series[:150])
+
+
+def test_plot(tmp_path):
+    """
+    Test that solved models are plotted, from memory or from their results file, alone or in a batch.
+    """
+    models = [Model(file), Model(file)]
+    for model in models:
+        model.solve(method='analytic')
+    del models[1].timeseries
+
+    outputs = [str(tmp_path / 'first.png'), str(tmp_path / 'second.png')]
+    assert plot_models(models, outputs, dpi=50) == outputs
+    assert all(os.path.getsize(output) > 0 for output in outputs)
+    models[0].plot(output=str(tmp_path / 'full.png'), dpi=50, decimate=False)
+    assert os.path.exists(tmp_path / 'full.png')
+
+    with pytest.raises(ValueError):
+        Model(file).plot(output=str(tmp_path / 'unsolved.png'))
+    with pytest.raises(ValueError):
+        plot_models(models, outputs[:1])
@@ -0,0 +1,63 @@
+"""
+This module contains unit tests for the columnar results files in the results module.
+"""
+import os
+import numpy as np
+import pytest
+from PKPy.model import Model, load_timeseries
+from PKPy.results import ResultsReader, ResultsWriter, unique_results_path
+
+file = os.path.join(os.path.dirname(__file__), "test_model_subc.json")
+
+
+def test_write_and_read(tmp_path):
+    """
+    Test that windows written to a results file are read back as memory-mapped views, by compartment and time window.
+    """
+    path = str(tmp_path / 'run.pkpy')
+    data = np.arange(30.0).reshape(3, 10)
+    with ResultsWriter(path, ['a', 'b', 'c'], 10, start=5, step=0.5, model_hash='abc') as writer:
+        writer.write(0, data[:, :4])
+        assert not os.path.exists(path)
+        writer.write(4, data[:, 4:])
+    assert os.listdir(tmp_path) == ['run.pkpy']
+
+    results = ResultsReader(path)
+    assert results.model_hash == 'abc' and results.compartments == ['a', 'b', 'c']
+    assert np.array_equal(results.times, 5 + 0.5 * np.arange(10))
+    assert isinstance(results['b'], np.memmap) and np.array_equal(results['b'], data[1])
+    assert results.data.ctypes.data % 64 == 0
+    assert np.array_equal(results.window(6, 7.1), data[:, 2:5])
+    window = results.window(6, None, ['c'])
+    assert isinstance(window, np.memmap) and np.array_equal(window, data[2:, 2:])
+    assert np.array_equal(results.window(compartments=['c', 'a']), data[[2, 0]])
+    with pytest.raises(KeyError):
+        results['d']
+
+
+def test_model_results_file():
+    """
+    Test that each solve writes a new results file, which holds the solution and the model hash.
+    """
+    model = Model(file)
+    timeseries = model.solve(method='analytic')
+    first = model.results_path
+    model.solve(method='analytic')
+    assert model.results_path != first and unique_results_path() != unique_results_path()
+
+    results = ResultsReader(model.results_path)
+    assert results.model_hash == model.config_hash
+    loaded = load_timeseries(first)
+    for name in timeseries:
+        assert np.array_equal(loaded[name], timeseries[name])
+
+    # results of earlier versions of PKPy, a single pickled dictionary
+    import pickle
+    legacy = os.path.join(os.path.dirname(first), 'legacy.pickle')
+    with open(legacy, 'wb') as handle:
+        pickle.dump(timeseries, handle)
+    assert all(np.array_equal(load_timeseries(legacy)[name], timeseries[name]) for name in timeseries)
+    with open(legacy, 'wb') as handle:
+        pickle.dump([1, 2], handle)
+    with pytest.raises(ValueError):
+        load_timeseries(legacy)
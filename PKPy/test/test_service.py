@@ -0,0 +1,102 @@
+"""
+This module contains unit tests for the batching solver service in the service module.
+"""
+import os
+import json
+import copy
+import asyncio
+import numpy as np
+import pytest
+from PKPy.model import Model
+from PKPy.system_parser import Parser
+from PKPy.service import SolverService, serve, structure_key
+
+with open(os.path.join(os.path.dirname(__file__), "test_model_schedule.json")) as f:
+    config = json.load(f)
+
+
+def variant(volume):
+    changed = copy.deepcopy(config)
+    changed['compartment_3']['volume'] = volume
+    return changed
+
+
+def test_parser_accepts_dicts():
+    """
+    Test that a configuration dictionary is parsed like the file, without being modified.
+    """
+    original = copy.deepcopy(config)
+    file = os.path.join(os.path.dirname(__file__), "test_model_schedule.json")
+    assert Parser(config).construct() == Parser(file).construct()
+    assert config == original
+    assert structure_key(*Parser(variant(10)).construct()) == structure_key(*Parser(config).construct())
+    other = copy.deepcopy(config)
+    other['basic_parameters']['time_span'] = 1000
+    assert structure_key(*Parser(other).construct()) != structure_key(*Parser(config).construct())
+
+
+def test_concurrent_requests_are_batched(tmp_path, monkeypatch):
+    """
+    Test that concurrent requests of the same structure are solved in one batch, that the results match
+    individual solves, and that nothing is written to the filesystem.
+    """
+    monkeypatch.chdir(tmp_path)
+    short = copy.deepcopy(config)
+    short['basic_parameters'] = {'time_span': 50, 'subcutaneous': 1, 'dose': [20, 'continuous']}
+    configs = [variant(volume) for volume in (100, 200, 300, 400, 500)] + [short]
+
+    async def run():
+        async with SolverService(max_batch=3, max_pending=2) as service:
+            results = await asyncio.gather(*[service.solve(c) for c in configs])
+            with pytest.raises(ValueError):
+                await service.solve(variant(-1))
+        return results, service.stats
+
+    results, stats = asyncio.run(run())
+    for c, result in zip(configs, results):
+        expected = Model(c).solve(method='analytic', save=False)
+        assert all(np.allclose(result[name], expected[name]) for name in expected)
+    assert stats['requests'] == 6 and stats['solves'] < 6 and stats['largest_batch'] <= 3
+    assert os.listdir(tmp_path) == []
+
+
+def test_serve():
+    """
+    Test that JSON-lines requests get one response each, with errors reported per request.
+    """
+    lines = [json.dumps({'id': i, 'config': variant(100 * (i + 1))}) + '\n' for i in range(3)]
+    lines += ['not json\n', json.dumps({'id': 'bad', 'config': variant(0)}) + '\n']
+    output = []
+
+    async def reader():
+        return lines.pop(0) if lines else ''
+
+    asyncio.run(serve(reader, output.append, SolverService()))
+    responses = {response['id']: response for response in map(json.loads, output)}
+    assert len(output) == 5 and set(responses) == {0, 1, 2, None, 'bad'}
+    expected = Model(variant(200)).solve(method='analytic', save=False)
+    assert np.allclose(responses[1]['timeseries']['liver'], expected['liver'])
+    assert 'error' in responses[None] and 'error' in responses['bad']
+
+
+def test_batch_errors_fail_requests(monkeypatch):
+    """
+    Test that an error outside of the solve of a batch fails the requests of that batch, and that the service
+    keeps serving later requests.
+    """
+    parameter_table = Model.parameter_table
+
+    def failing(model):
+        if model.volumes[1] == 13:
+            raise RuntimeError("broken")
+        return parameter_table(model)
+    monkeypatch.setattr(Model, 'parameter_table', failing)
+
+    async def run():
+        async with SolverService() as service:
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(service.solve(variant(13)), timeout=10)
+            return await asyncio.wait_for(service.solve(variant(100)), timeout=10)
+
+    result = asyncio.run(run())
+    assert np.allclose(result['liver'], Model(variant(100)).solve(method='analytic', save=False)['liver'])
@@ -0,0 +1,58 @@
+"""
+This module contains unit tests for the process-pool parameter sweep in the sweep module.
+"""
+import os
+import numpy as np
+import pytest
+from PKPy.model import Model
+from PKPy.sweep import ParameterSweep, apply_overrides
+
+file = os.path.join(os.path.dirname(__file__), "test_model_subc.json")
+
+
+def test_apply_overrides():
+    """
+    Test that overrides replace the right parameters without modifying the base configuration.
+    """
+    sweep = ParameterSweep(file)
+    basic_params, compartments = apply_overrides(sweep.basic_params, sweep.compartments,
+                                                 {'basic_parameters': {'time_span': 50}, 'liver': {'volume': 10}})
+    assert basic_params['time_span'] == 50
+    assert [c['volume'] for c in compartments if c['name'] == 'liver'] == [10]
+    assert sweep.basic_params['time_span'] == 10000
+    with pytest.raises(ValueError):
+        apply_overrides(sweep.basic_params, sweep.compartments, {'kidney': {'volume': 10}})
+
+    # overridden configurations are validated and completed like parsed ones
+    with pytest.raises(ValueError):
+        apply_overrides(sweep.basic_params, sweep.compartments, {'liver': {'volume': 0}})
+    basic_params, _ = apply_overrides(sweep.basic_params, sweep.compartments,
+                                      {'basic_parameters': {'dosing_schedule': [{'time': 5, 'amount': 10}]}})
+    assert basic_params['dosing_schedule'] == [{'time': 5, 'amount': 10, 'route': 'subcutaneous', 'duration': 0}]
+    with pytest.raises(ValueError, match="Parameter set 1"):
+        next(sweep.run([{'liver': {'volume': 10}}, {'liver': {'volume': 0}}]))
+    with pytest.raises(ValueError):
+        next(sweep.run([{'liver': {'volume': 10}}], save=True))
+    with pytest.raises(ValueError):
+        ParameterSweep(file, chunk_size=0)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_run(ordered):
+    """
+    Test that a sweep returns the same solutions as individual solves, in the requested order.
+    """
+    param_sets = [{'basic_parameters': {'time_span': 100}, 'liver': {'volume': v}} for v in [100, 200, 300, 400, 500]]
+    param_sets.append({'basic_parameters': {'time_span': 100, 'dosing_schedule': [{'time': 5, 'amount': 10}]}})
+    sweep = ParameterSweep(file, max_workers=2, chunk_size=2)
+    results = list(sweep.run(param_sets, ordered=ordered, method='analytic'))
+
+    indices = [index for index, _ in results]
+    assert sorted(indices) == list(range(len(param_sets)))
+    if ordered:
+        assert indices == list(range(len(param_sets)))
+    for index, timeseries in results:
+        model = Model.from_config(*apply_overrides(sweep.basic_params, sweep.compartments, param_sets[index]))
+        expected = model.solve(method='analytic', save=False)
+        for name in expected:
+            assert np.allclose(timeseries[name], expected[name])